@@ -0,0 +1,271 @@
+#! python3
+
+"""Time pack builds on synthetic packs.
+
+A pack of made-up tracks is generated (valid Ogg Vorbis framing around
+random data, and small noise textures), with a given number of tracks, audio
+size and share of tracks whose names clash once cleaned up. Then the old
+staging pipeline is timed stage by stage (_makeDirs, _makeTextFiles,
+_copyFiles, _zipUpFolder) and whole builds with _makePack, each in a fresh
+process, for wall time, CPU time (worker processes included), peak RSS and
+bytes written. Results can be saved as JSON and compared with an earlier run.
+
+Each job count is built without a cache, then with an empty one and again
+with it full. Every one of those builds must make the same zip, byte for
+byte, as -j 1 does; the run fails if their SHA-256s differ. They are built
+in reproducible mode, so the time of the build doesn't get in the way, and
+deflate everything by default (like the staged pipeline does), so the process
+pool and the cache have work to do.
+
+    python benchmarks/build.py [--tracks N] [--audio-size KB] [--collisions 0.1]
+                               [--jobs 1 4] [--compression-rules deflate]
+                               [--json results.json] [--compare old.json]
+"""
+
+from pathlib import Path
+from time import perf_counter
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+def _randomBytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, 'little') if size else b''
+
+def syntheticOgg(rng, size, serial):
+    '''Bytes of an Ogg Vorbis file about size long: real headers and page framing,
+    random audio packets. Enough for pack_ogg to inspect, not to play.'''
+    from struct import pack
+    import pack_ogg
+    ident = b'\x01vorbis' + pack('<IBIiiiBB', 0, 2, 44100, 0, 128000, 0, 0xb8, 1)
+    comment = b'\x03vorbis' + pack('<I', 9) + b'benchmark' + pack('<I', 0) + b'\x01'
+    setup = b'\x05vorbis' + _randomBytes(rng, 3000)
+    pages = [pack_ogg._makePage(2, 0, serial, 0, [len(ident)], ident)]
+    pages.extend(pack_ogg._pagePackets([comment, setup], serial, 1))
+    # a 4080 byte packet per page, about 1/4 s of audio at 128 kbps
+    count = max(1, (size - sum(map(len, pages))) // 4115)
+    for i in range(count):
+        pages.append(pack_ogg._makePage(4 if i == count - 1 else 0, (i + 1) * 11025, serial,
+                                        len(pages), [255] * 16 + [0], _randomBytes(rng, 4080)))
+    return b''.join(pages)
+
+def syntheticPng(rng, size):
+    '''Bytes of a size x size PNG of random pixels'''
+    from struct import pack
+    import zlib
+    import pack_textures
+    rows = b''.join(b'\x00' + _randomBytes(rng, size * 4) for y in range(size))
+    return pack_textures.makePng([(b'IHDR', pack('>IIBBBBB', size, size, 8, 6, 0, 0, 0)),
+                                  (b'IDAT', zlib.compress(rows, 9)), (b'IEND', b'')])
+
+def generatePack(folder, tracks=100, audio_size=1024 * 1024, texture_size=16, collisions=0.0, seed=0):
+    '''Write a synthetic pack's sources into folder, returning (music, pack_info).
+
+    A `collisions` share of the tracks (up to half) get a file name that differs
+    from another track's only in case and punctuation, so their record names clash.'''
+    from random import Random
+    import musica_resource_packotron as mt
+    rng = Random(seed)
+    folder = Path(folder)
+    (folder / 'audio').mkdir(parents=True, exist_ok=True)
+    (folder / 'textures').mkdir(exist_ok=True)
+    audiofiles = list()
+    texturefiles = list()
+    clashing = int(tracks * min(collisions, 0.5))
+    for i in range(tracks):
+        if i < clashing:
+            # "Track_0005" vs "track 0005": different files, same record name
+            stem = 'Track_%04d' % (i + clashing)
+        else:
+            stem = 'track %04d' % i
+        audiopath = folder / 'audio' / (stem + '.ogg')
+        audiopath.write_bytes(syntheticOgg(rng, audio_size, i + 1))
+        texturepath = folder / 'textures' / (stem + '.png')
+        texturepath.write_bytes(syntheticPng(rng, texture_size))
+        audiofiles.append([audiopath])
+        texturefiles.append([texturepath])
+    thumbnail = folder / 'pack.png'
+    thumbnail.write_bytes(syntheticPng(rng, 128))
+    music = mt._fillInfo(audiofiles, texturefiles)
+    pack_info = {
+        'packName' : 'Benchmark Pack',
+        'packAuthor' : 'benchmark',
+        'description' : 'A synthetic pack of %s tracks.' % tracks,
+        'thumbnailPath' : thumbnail,
+        }
+    return music, pack_info
+
+def _cpuTime():
+    from os import times
+    t = times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def _peakRss():
+    '''Peak resident set size of this process or any of its finished children, in bytes'''
+    try:
+        import resource
+    except ImportError:
+        # there is no resource module on Windows
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+def _folderSize(folder):
+    return sum(path.stat().st_size for path in Path(folder).glob('**/*') if path.is_file())
+
+def _timed(function):
+    '''Run function, returning its result and {wall, cpu, peakRss}'''
+    wall = perf_counter()
+    cpu = _cpuTime()
+    result = function()
+    return result, {'wall' : perf_counter() - wall, 'cpu' : _cpuTime() - cpu, 'peakRss' : _peakRss()}
+
+def runStages(music, pack_info, outputdir):
+    '''Build with the old staging pipeline, timing each stage. Runs in its own process.'''
+    import musica_resource_packotron as mt
+    outputdir = Path(outputdir)
+    results = dict()
+    folder, results['_makeDirs'] = _timed(lambda: mt._makeDirs(pack_info, outputdir))
+    results['_makeDirs']['bytesWritten'] = 0
+    written = _folderSize(folder)
+    for name, stage in (
+            ('_makeTextFiles', lambda: mt._makeTextFiles(folder, music, pack_info)),
+            ('_copyFiles', lambda: mt._copyFiles(folder, [info['audioPath'] for info in music.values()],
+                                                 list(music), [info['texturePath'] for info in music.values()],
+                                                 pack_info['thumbnailPath']))):
+        result, results[name] = _timed(stage)
+        results[name]['bytesWritten'] = _folderSize(folder) - written
+        written += results[name]['bytesWritten']
+    result, results['_zipUpFolder'] = _timed(lambda: mt._zipUpFolder(folder, outputdir))
+    results['_zipUpFolder']['bytesWritten'] = folder.with_suffix('.rpack.zip').stat().st_size
+    results['staged build'] = {
+        'wall' : sum(result['wall'] for result in results.values()),
+        'cpu' : sum(result['cpu'] for result in results.values()),
+        'peakRss' : _peakRss(),
+        'bytesWritten' : sum(result['bytesWritten'] for result in results.values()),
+        }
+    return results
+
+def runBuild(music, pack_info, outputdir, jobs=1, rules='deflate', cachedir=None):
+    '''Build with _makePack, with a pack_cache.MemberCache in cachedir if given.
+    Runs in its own process.'''
+    import musica_resource_packotron as mt
+    import pack_cache
+    cache = pack_cache.MemberCache(cachedir) if cachedir is not None else None
+    report, result = _timed(lambda: mt._makePack(
+        music, pack_info, outputdir, mt.CompressionPolicy(rules), jobs=jobs, cache=cache,
+        reproducible=mt.ReproducibleSettings(0)))
+    result['bytesWritten'] = report.zippath.stat().st_size
+    result['sha256'] = report.sha256
+    return result
+
+def _inFreshProcess(function, *args, **kwds):
+    '''Call function in a new process, so its peak RSS is its own'''
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(function, *args, **kwds).result()
+
+def runAll(workdir, tracks=100, audio_size=1024 * 1024, texture_size=16, collisions=0.0,
+           jobs=(1,), seed=0, rules='deflate'):
+    '''Generate a pack in workdir and time everything, giving the results as a dict for JSON.
+    results['identical'] tells whether every _makePack build made the same zip.'''
+    from shutil import rmtree
+    from os import cpu_count
+    import platform
+    workdir = Path(workdir)
+    sources = workdir / 'sources'
+    start = perf_counter()
+    music, pack_info = generatePack(sources, tracks, audio_size, texture_size, collisions, seed)
+    results = {
+        'params' : {'tracks' : tracks, 'audioSize' : audio_size, 'textureSize' : texture_size,
+                    'collisions' : collisions, 'jobs' : list(jobs), 'seed' : seed, 'rules' : rules},
+        'environment' : {'python' : platform.python_version(), 'platform' : platform.platform(),
+                         'cpus' : cpu_count()},
+        'generateSeconds' : perf_counter() - start,
+        'results' : dict(),
+        }
+    outputdir = workdir / 'staged'
+    outputdir.mkdir()
+    results['results'].update(_inFreshProcess(runStages, music, pack_info, outputdir))
+    rmtree(str(outputdir))
+    for j in jobs:
+        cachedir = workdir / ('cache%s' % j)
+        for name, cache in (('', None), (', cold cache', cachedir), (', warm cache', cachedir)):
+            outputdir = workdir / ('jobs%s' % j)
+            outputdir.mkdir()
+            results['results']['_makePack -j %s%s' % (j, name)] = _inFreshProcess(
+                runBuild, music, pack_info, outputdir, j, rules, cache)
+            rmtree(str(outputdir))
+        rmtree(str(cachedir), ignore_errors=True)
+    digests = {result['sha256'] for result in results['results'].values() if 'sha256' in result}
+    results['identical'] = len(digests) == 1
+    return results
+
+def printResults(results, compare=None):
+    '''A table of the results, with speedups against an earlier run if given'''
+    import musica_resource_packotron as mt
+    before = compare['results'] if compare is not None else dict()
+    print('%-28s %9s %9s %10s %10s%s' % ('', 'wall', 'cpu', 'peak RSS', 'written',
+                                        '   vs before' if compare is not None else ''))
+    for name, result in results['results'].items():
+        line = '%-28s %8.3fs %8.3fs %10s %10s' % (
+            name, result['wall'], result['cpu'],
+            mt._formatBytes(result['peakRss']) if result['peakRss'] is not None else '-',
+            mt._formatBytes(result['bytesWritten']))
+        if name in before and result['wall'] > 0:
+            line += '   %6.2fx' % (before[name]['wall'] / result['wall'])
+        print(line)
+
+def main(argv=None):
+    import argparse
+    import json
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    parser = argparse.ArgumentParser(description='Time pack builds on a synthetic pack.')
+    parser.add_argument('--tracks', type=int, default=100, help='Tracks in the pack (default: 100).')
+    parser.add_argument('--audio-size', type=int, default=1024, help='KB of audio per track (default: 1024).')
+    parser.add_argument('--texture-size', type=int, default=16, help='Texture size in pixels (default: 16).')
+    parser.add_argument('--collisions', type=float, default=0.1,
+                        help='Share of tracks whose names clash with another (default: 0.1).')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1],
+                        help='Build with each of these many jobs (default: 1).')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated pack.')
+    parser.add_argument('--compression-rules', default='deflate',
+                        help="Compression rule set for the _makePack builds (default: 'deflate').")
+    parser.add_argument('--workdir', type=Path, help='Where to generate and build (default: a temporary folder).')
+    parser.add_argument('--json', type=Path, help='Save the results to this JSON file.')
+    parser.add_argument('--compare', type=Path, help='Show speedups against results saved earlier.')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or Path(mkdtemp(prefix='packotron-bench-'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        results = runAll(workdir, args.tracks, args.audio_size * 1024, args.texture_size,
+                         args.collisions, args.jobs, args.seed, args.compression_rules)
+    finally:
+        if args.workdir is None:
+            rmtree(str(workdir), ignore_errors=True)
+    compare = None
+    if args.compare is not None:
+        with args.compare.open() as f:
+            compare = json.load(f)
+    print('%s tracks of %s KB, %.0f%% name collisions (generated in %.2fs)' % (
+        args.tracks, args.audio_size, args.collisions * 100, results['generateSeconds']))
+    printResults(results, compare)
+    if args.json is not None:
+        with args.json.open('w') as f:
+            json.dump(results, f, indent=4)
+    if not results['identical']:
+        print('FAIL: the builds made different zips:')
+        for name, result in results['results'].items():
+            if 'sha256' in result:
+                print('  %-28s %s' % (name, result['sha256']))
+        raise SystemExit(1)
+    print('All %s _makePack builds made the same zip (SHA-256 %s).' % (
+        sum('sha256' in result for result in results['results'].values()),
+        next(result['sha256'] for result in results['results'].values() if 'sha256' in result)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#! python3
+
+"""How long the command line and the GUI take to come up, against a budget.
+
+Each measurement runs in a fresh interpreter a few times and keeps the
+median, less the time a bare interpreter takes to start, so only what the
+tool itself costs counts against the budget. The slowest imports (from
+-X importtime) are recorded beside the timings, to show where time went.
+Exits with 1 if anything is over budget, or fails to run at all; only the
+GUI's, with no display to open a window on, are skipped.
+
+    python benchmarks/startup.py [--runs N] [--json results.json]
+"""
+
+from pathlib import Path
+from time import perf_counter
+import subprocess
+import sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# seconds on top of a bare interpreter's startup
+BUDGETS = {
+    'help' : 0.10,
+    'import core' : 0.05,
+    'import gui' : 0.08,
+    'first window' : 0.50,
+    }
+
+MEASUREMENTS = {
+    'help' : [str(ROOT / 'musica_resource_packotron.py'), '--help'],
+    'import core' : ['-c', 'import musica_resource_packotron'],
+    'import gui' : ['-c', 'import resource_pack_gui'],
+    # up to the first window being drawn
+    'first window' : ['-c', 'import resource_pack_gui; resource_pack_gui.make_window().update()'],
+    }
+
+def _run(args, flags=()):
+    '''Run python with args from the repo folder, returning (seconds, completed process)'''
+    start = perf_counter()
+    result = subprocess.run([sys.executable] + list(flags) + args, cwd=str(ROOT),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return perf_counter() - start, result
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+def slowestImports(args, count=10):
+    '''The modules with the most import time of their own, as [(name, self us, cumulative us)]'''
+    seconds, result = _run(args, ['-X', 'importtime'])
+    imports = list()
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(own), int(cumulative)))
+    return sorted(imports, key=lambda entry: entry[1], reverse=True)[:count]
+
+def measure(runs=5):
+    '''Time everything, giving {name : result dict}'''
+    # frozen builds ship bytecode, so time with it up to date
+    import compileall
+    compileall.compile_dir(str(ROOT), maxlevels=0, quiet=1)
+    interpreter = _median([_run(['-c', 'pass'])[0] for i in range(runs)])
+    results = dict()
+    for name, args in MEASUREMENTS.items():
+        times = list()
+        for i in range(runs):
+            seconds, result = _run(args)
+            if result.returncode != 0:
+                break
+            times.append(seconds)
+        if not times:
+            stderr = result.stderr.decode('utf-8', 'replace').strip()
+            last = stderr.splitlines()[-1] if stderr else 'exit code %s' % result.returncode
+            # tkinter can't open a window without a display, nothing wrong with the tool
+            no_display = 'TclError' in stderr and ('display' in stderr.lower() or 'DISPLAY' in stderr)
+            results[name] = {'skipped' if no_display else 'failed' : last}
+            continue
+        overhead = _median(times) - interpreter
+        results[name] = {
+            'seconds' : overhead,
+            'budget' : BUDGETS[name],
+            'overBudget' : overhead > BUDGETS[name],
+            'slowestImports' : slowestImports(args),
+            }
+    results['interpreter'] = {'seconds' : interpreter}
+    return results
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Check startup times against their budget.')
+    parser.add_argument('--runs', type=int, default=5, help='Runs to take the median of (default: 5).')
+    parser.add_argument('--json', type=Path, help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    print('Bare interpreter: %.1f ms' % (results['interpreter']['seconds'] * 1000))
+    over = list()
+    for name in MEASUREMENTS:
+        result = results[name]
+        if 'skipped' in result:
+            print('%-13s skipped (%s)' % (name + ':', result['skipped']))
+            continue
+        if 'failed' in result:
+            print('%-13s FAILED (%s)' % (name + ':', result['failed']))
+            over.append(name)
+            continue
+        print('%-13s %6.1f ms  (budget %.0f ms)%s' % (name + ':', result['seconds'] * 1000,
+              result['budget'] * 1000, '  OVER BUDGET' if result['overBudget'] else ''))
+        for module, own, cumulative in result['slowestImports'][:5]:
+            print('    %-30s %6.1f ms' % (module, own / 1000))
+        if result['overBudget']:
+            over.append(name)
+    if args.json is not None:
+        import json
+        with args.json.open('w') as f:
+            json.dump(results, f, indent=4)
+    # over budget or failed
+    return 1 if over else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
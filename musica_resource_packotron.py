@@ -2,42 +2,61 @@
 
 """Create Minecraft Resource Packs for Musica."""
 
+# keep this light, so --help and the GUI come up quickly: anything only some
+# commands need (json, zipfile, shutil, argparse, ...) is imported where it's used
 from pathlib import Path
-import json
-import argparse
-from zipfile import ZipFile, ZIP_DEFLATED
-from shutil import copy, rmtree
-from os import chdir
+from itertools import zip_longest, chain
+from os import replace, cpu_count, name as os_name
+from time import perf_counter, process_time, localtime, gmtime
+import re
+import zlib
+import pack_zip
+from pack_zip import ZIP_DEFLATED, ZIP_STORED
+import pack_cache
+import pack_transcode
+import pack_ogg
+import pack_textures
+
+_FILENAME_WORDS = re.compile(r'[\w\-_]+')
 
 def _processFilename(filename):
     '''Make filenames flat and computer friendly'''
-    import re
     # title case and remove spaces
-    clean_name = '_'.join(re.findall(r'[\w\-_]+', filename.title()))
+    clean_name = '_'.join(_FILENAME_WORDS.findall(filename.title())) or 'track'
     # lowercase first character
     clean_name = clean_name[0].lower() + clean_name[1:]
     return clean_name
 
-# generate textures?
-# would need Pillow or pypng + mathy stuff to shift hue
+class NameAllocator:
+    '''Hand out unique record names, numbering any that are already taken
+    ("name", "name1", "name2", ...). Each name costs O(1) on average, since
+    the next number to try is remembered for every base name.'''
+
+    def __init__(self, taken=()):
+        self.taken = set(taken)
+        self._next = dict()
+
+    def allocate(self, name):
+        if name not in self.taken:
+            self.taken.add(name)
+            return name
+        i = self._next.get(name, 1)
+        while name + str(i) in self.taken:
+            i += 1
+        self._next[name] = i + 1
+        self.taken.add(name + str(i))
+        return name + str(i)
 
 def _fillInfo(audiofiles, texturefiles, fileinfo=list()):
     '''Consolidate info for music'''
-    from itertools import zip_longest, chain
     # process audio files' filenames (unsure if is this really needed... can't hurt though)
     music = dict()
+    names = NameAllocator()
     for filethings in zip_longest(audiofiles, texturefiles,fileinfo, fillvalue=[None]):
         filethings = tuple(chain.from_iterable(filethings))
         path = Path(filethings[0])
-        clean_name = _processFilename(path.stem)
         # account for duplicate cleaned names
-        while clean_name in music:
-            if i is not int:
-                i = 1
-            else:
-                i += 1
-            if clean_name + str(i) not in music:
-                clean_name + str(i)
+        clean_name = names.allocate(_processFilename(path.stem))
         # Set default infos
         music[clean_name] = {
             'description' : path.stem,
@@ -72,8 +91,10 @@ def _makeDirs(packinfo, outputdir=None):
     (folder / r'assets/musica/textures/items').mkdir(parents=True)
     return folder.resolve()
 
-def _makeTextFiles(folder, music, pack_info=dict()):
-    '''Write the json text files for the resource pack'''
+def _makeTextContents(music, pack_info=dict(), sounds=None):
+    '''Make the json text files for the resource pack, keyed by their path in the pack.
+    sounds maps record names to the sound file they play (defaults to their own audio file).'''
+    from json import dumps
     pack_mcmeta = {
             "language": {
                 "en_US": {
@@ -113,39 +134,41 @@ def _makeTextFiles(folder, music, pack_info=dict()):
             'isShiny' : track[1].get('isShiny', False),
             'useSpecialName' : track[1].get('useSpecialName', False),
             }
-    # create the text files:
-
-    # pack.mcmeta
-    with (folder / r'pack.mcmeta').open('w') as f:
-        json.dump(pack_mcmeta, f, indent=4)
-
-    # record-pack.json
-    with (folder / r'record-pack.json').open('w') as f:
-        json.dump(record_pack, f, indent=4)
-
-    # assets\musica\sounds.json
-    with (folder / r'assets/musica/sounds.json').open('w') as f:
-        sounds = { 'records.%s' % name : {
-            'category' : 'record',
-            'sounds' : [{
-                'name' : 'records/%s' % info['audioPath'].stem,
-                'stream' : True,
-                }],
-            } for name, info in music.items()}
-        json.dump(sounds, f, indent=4)
-    
-    # assets\musica\lang\en_US.lang
-    with (folder / r'assets/musica/lang/en_US.lang').open('w') as f:
-        f.write('#Record Descriptions')
-        for name, info in music.items():
-            f.write('\nitem.record.{}.desc={}'.format(name, info['description']))
-            if 'lore' in info:
-                f.write('\nitem.record.{}.lore={}'.format(name, info['lore']))
-            if 'specialName' in info:
-                f.write('\nitem.musica.record.{}.name={}'.format(name, info['specialName']))
+
+    sounds = { 'records.%s' % name : {
+        'category' : 'record',
+        'sounds' : [{
+            'name' : 'records/%s' % (sounds[name] if sounds is not None
+                                     else Path(info['audioPath']).stem),
+            'stream' : True,
+            }],
+        } for name, info in music.items()}
+
+    lang = ['#Record Descriptions']
+    for name, info in music.items():
+        lang.append('item.record.{}.desc={}'.format(name, info['description']))
+        if 'lore' in info:
+            lang.append('item.record.{}.lore={}'.format(name, info['lore']))
+        if 'specialName' in info:
+            lang.append('item.musica.record.{}.name={}'.format(name, info['specialName']))
+
+    # pack.mcmeta, record-pack.json, assets\musica\sounds.json, assets\musica\lang\en_US.lang
+    return {
+        'pack.mcmeta' : dumps(pack_mcmeta, indent=4),
+        'record-pack.json' : dumps(record_pack, indent=4),
+        'assets/musica/sounds.json' : dumps(sounds, indent=4),
+        'assets/musica/lang/en_US.lang' : '\n'.join(lang),
+        }
+
+def _makeTextFiles(folder, music, pack_info=dict()):
+    '''Write the json text files for the resource pack'''
+    for arcname, text in _makeTextContents(music, pack_info).items():
+        with (folder / arcname).open('w') as f:
+            f.write(text)
 
 def _copyFiles(folder, audioPaths, names, texturePaths, packTexturePath=None):
     '''Grab the premade files and copy them to proper place'''
+    from shutil import copy
     # Copy files into folder:
     # pack cover picture - > pack.png
     if packTexturePath is not None and packTexturePath.exists():
@@ -171,37 +194,1321 @@ def _copyFiles(folder, audioPaths, names, texturePaths, packTexturePath=None):
 def _zipUpFolder(inputdir,outputdir=None):
     '''Compress everything in a directory, name it after the dir,
     and put it in output dir (defaults to inputdir).'''
+    from zipfile import ZipFile
     if outputdir is None:
         outputdir = inputdir
     inputdir = Path(inputdir)
     outputdir = Path(outputdir)
-    files = inputdir.glob('**/*.*')
+    # in the same order whatever order the filesystem lists them in
+    files = sorted(inputdir.glob('**/*.*'))
     with ZipFile(str(outputdir / inputdir.with_suffix('.rpack.zip').name), 'w', ZIP_DEFLATED) as zf:
         for file in files:
             zf.write(str(file), str(file.relative_to(inputdir)))
 
-def _makePack(music, pack_info, outputdir):
-    '''Use args to make a resource pack.'''
-    # fill info
-    names = list()
-    audioPaths = list()
-    texturePaths = list()
-    for name,info in music.items():
-        names.append(name)
-        audioPaths.append(info['audioPath'])
-        texturePaths.append(info['texturePath'])
-    # make directories (actual or temp?)
-    folder = _makeDirs(pack_info, outputdir)
-    # make text files
-    _makeTextFiles(folder, music, pack_info)
-    # copy non-text files
-    _copyFiles(folder, audioPaths, music.keys(), texturePaths,
-               Path(pack_info['thumbnailPath']) if ('thumbnailPath' in pack_info and pack_info['thumbnailPath'] is not None) else None)
-    # compress directory
-    _zipUpFolder(folder,outputdir)
-    rmtree(str(folder))
+class CompressionPolicy:
+    '''Decide how each pack member is put in the zip.
+
+    Rules map a file extension to 'store', 'deflate' or 'probe'; '*' is used for
+    anything not listed. 'probe' deflates a sample of the file and stores it
+    whenever that saves less than `threshold` of the sample's size.'''
+
+    rulesets = {
+        # .ogg and .png are already compressed, text compresses well
+        'default' : {'.ogg' : 'store', '.png' : 'store', '.json' : 'deflate',
+                     '.lang' : 'deflate', '.mcmeta' : 'deflate', '*' : 'probe'},
+        'deflate' : {'*' : 'deflate'},
+        'store' : {'*' : 'store'},
+        'probe' : {'*' : 'probe'},
+        }
+
+    # files stored by rule are only sampled for the report, so a few per extension will do
+    report_samples = 8
+
+    def __init__(self, rules='default', level=6, threshold=0.05, sample_size=64*1024):
+        if isinstance(rules, str):
+            if rules not in self.rulesets:
+                raise ValueError("Unknown compression rule set '%s', use one of: %s"
+                                 % (rules, ', '.join(self.rulesets)))
+            rules = self.rulesets[rules]
+        self.rules = {ext.lower() : action for ext, action in rules.items()}
+        for action in self.rules.values():
+            if action not in ('store', 'deflate', 'probe'):
+                raise ValueError("Unknown compression action '%s'" % action)
+        if not 0 <= level <= 9:
+            raise ValueError('Compression level must be between 0 and 9')
+        self.level = level
+        self.threshold = threshold
+        self.sample_size = sample_size
+        self._sampled = dict()
+
+    @classmethod
+    def fromInfo(cls, info):
+        '''Make a policy from a "compression" dict, as found in a JSON file'''
+        info = info or dict()
+        return cls(rules=info.get('rules', 'default'),
+                   level=info.get('level', 6),
+                   threshold=info.get('threshold', 0.05))
+
+    def _sample(self, path):
+        '''Deflate a chunk from the middle of a file, giving (bytes in, bytes out, seconds)'''
+        size = path.stat().st_size
+        with path.open('rb') as f:
+            f.seek(max(0, size // 2 - self.sample_size // 2))
+            data = f.read(self.sample_size)
+        start = perf_counter()
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        out = len(compressor.compress(data)) + len(compressor.flush())
+        return len(data), out, perf_counter() - start
+
+    def key(self):
+        '''The settings that change what gets written, as a string'''
+        return 'compression:%s:%s:%s' % (','.join('%s=%s' % rule for rule in sorted(self.rules.items())),
+                                         self.level, self.threshold)
+
+    def choose(self, arcname, source):
+        '''Pick (compress_type, sample) for a member; sample is None when nothing was probed.
+
+        The first few files of each type stored by rule are sampled too, so the
+        report can tell what deflating them would have saved and cost. Text always
+        compresses well, so probing it just deflates it, and text isn't sampled.'''
+        suffix = Path(arcname).suffix.lower()
+        action = self.rules.get(suffix, self.rules.get('*', 'probe'))
+        if self.level == 0:
+            return ZIP_STORED, None
+        if isinstance(source, str):
+            return (ZIP_STORED if action == 'store' else ZIP_DEFLATED), None
+        if action == 'deflate':
+            return ZIP_DEFLATED, None
+        if action == 'store':
+            sampled = self._sampled.get(suffix, 0)
+            if sampled >= self.report_samples:
+                return ZIP_STORED, None
+            self._sampled[suffix] = sampled + 1
+        sample = self._sample(source)
+        if action == 'probe' and sample[0] and (1 - sample[1] / sample[0]) >= self.threshold:
+            return ZIP_DEFLATED, sample
+        return ZIP_STORED, sample
+
+class ReproducibleSettings:
+    '''Build the same pack, byte for byte, from the same spec and files.
+
+    Records are listed sorted by name and members written sorted by path, all
+    with the same timestamp and permissions: $SOURCE_DATE_EPOCH when it is set
+    (as is the convention, it beats anything a spec says), or else timestamp, in
+    seconds since the epoch, or else the earliest a zip can hold.'''
+
+    # a plain rw-r--r-- file
+    external_attr = 0o100644 << 16
+
+    def __init__(self, timestamp=None):
+        from os import environ
+        if environ.get('SOURCE_DATE_EPOCH'):
+            timestamp = environ['SOURCE_DATE_EPOCH']
+            if not timestamp.strip().isdigit():
+                raise ValueError("SOURCE_DATE_EPOCH must be a whole number of seconds since 1970, not '%s'"
+                                 % timestamp)
+        elif timestamp is None:
+            timestamp = 315532800
+        elif not isinstance(timestamp, int) or isinstance(timestamp, bool):
+            raise ValueError('The reproducible "timestamp" must be a whole number of seconds since 1970, not %r'
+                             % (timestamp,))
+        self.timestamp = max(int(timestamp), 315532800)
+        self.date_time = gmtime(self.timestamp)[:6]
+
+    @classmethod
+    def fromInfo(cls, info):
+        '''Make settings from a "reproducible" dict, as found in a JSON file'''
+        return cls(timestamp=info.get('timestamp'))
+
+    def key(self):
+        return 'reproducible:%s' % self.timestamp
+
+class BuildCancelled(Exception):
+    '''A build was stopped before it finished'''
+
+class StageTimes:
+    '''Wall and CPU seconds spent in each stage of a build, in order.
+    CPU time is the whole process's, so it only adds up when one pack builds at a time.
+    Stages starting and ending are sent to events (a pack_events.BuildEvents), if given.'''
+
+    def __init__(self, events=None):
+        self.stages = list()
+        self.events = events
+        self._current = None
+
+    def start(self, name):
+        '''End the current stage, if any, and start timing the next'''
+        self.stop()
+        self._current = (name, perf_counter(), process_time())
+        if self.events is not None:
+            self.events.emit('stageStart', stage=name)
+
+    def stop(self):
+        if self._current is not None:
+            name, wall, cpu = self._current
+            stage = {'name' : name, 'wall' : perf_counter() - wall, 'cpu' : process_time() - cpu}
+            self.stages.append(stage)
+            self._current = None
+            if self.events is not None:
+                self.events.emit('stageEnd', stage=name, wall=stage['wall'], cpu=stage['cpu'])
+
+class BuildReport:
+    '''What went into a pack and how it was stored'''
+
+    def __init__(self, zippath=None):
+        self.zippath = zippath
+        self.members = list()
+        self.stages = StageTimes()
+        # bytes, when the build was run with profile=True
+        self.peak_memory = None
+        self.cache = None
+        # records pointed at audio already in the pack, and the bytes that saved
+        self.shared_audio = 0
+        self.audio_saved = 0
+        # (source, size before, size after) for re-encoded audio
+        self.transcoded = list()
+        # pack_ogg.inspect() results by sound file name
+        self.audio = dict()
+        self.warnings = list()
+        self.generated_textures = 0
+        # (source, size before, size after) for optimized textures
+        self.optimized = list()
+        # (source, size before, size after) for audio stripped of its metadata
+        self.stripped = list()
+        # with previous= builds: what each member was made from, and the settings
+        # and zip file it went into, for the next build to tell what changed
+        self.identities = None
+        self.settings = None
+        self.zip_identity = None
+        self.audio_hashes = None
+        self.audio_identities = None
+        self.reused = 0
+        # digests of the zip, worked out for reproducible builds
+        self.sha1 = None
+        self.sha256 = None
+
+    def totalSize(self):
+        '''Bytes that went into the pack'''
+        return sum(m['size'] for m in self.members)
+
+    def addMember(self, arcname, file_size, compress_size, compress_type, seconds, sample=None):
+        self.members.append({
+            'name' : arcname,
+            'size' : file_size,
+            'compressedSize' : compress_size,
+            'stored' : compress_type == ZIP_STORED,
+            'seconds' : seconds,
+            'sample' : sample,
+            })
+
+    def profile(self):
+        '''Where the build's time and bytes went, as a dict ready for JSON'''
+        profile = {
+            'zip' : str(self.zippath) if self.zippath is not None else None,
+            'wall' : sum(stage['wall'] for stage in self.stages.stages),
+            'cpu' : sum(stage['cpu'] for stage in self.stages.stages),
+            'peakMemory' : self.peak_memory,
+            'stages' : self.stages.stages,
+            'members' : [{
+                'name' : m['name'],
+                'size' : m['size'],
+                'compressedSize' : m['compressedSize'],
+                'ratio' : m['compressedSize'] / m['size'] if m['size'] else 1.0,
+                'stored' : m['stored'],
+                'seconds' : m['seconds'],
+                } for m in self.members],
+            }
+        if self.cache is not None:
+            profile['cache'] = {'hits' : self.cache.hits, 'misses' : self.cache.misses,
+                                'bytesHit' : self.cache.bytes_hit}
+        return profile
+
+    def summary(self):
+        '''Lines of text describing the build'''
+        stored = [m for m in self.members if m['stored']]
+        deflated = [m for m in self.members if not m['stored']]
+        lines = list()
+        vorbis = [info for info in self.audio.values() if info.get('codec') == 'vorbis']
+        if vorbis:
+            duration = sum(info['duration'] or 0 for info in vorbis)
+            lines.append('Audio: %s Vorbis file(s), %d:%02d:%02d long in total, %s kbps on average.' % (
+                len(vorbis), duration // 3600, duration % 3600 // 60, duration % 60,
+                int(sum(info['size'] for info in vorbis) * 8 / duration / 1000) if duration else '?'))
+        if deflated:
+            size = sum(m['size'] for m in deflated)
+            out = sum(m['compressedSize'] for m in deflated)
+            lines.append('Deflated %s member(s): %s -> %s (saved %s) in %.2fs.' % (
+                len(deflated), _formatBytes(size), _formatBytes(out), _formatBytes(size - out),
+                sum(m['seconds'] for m in deflated)))
+        if stored:
+            size = sum(m['size'] for m in stored)
+            # extrapolate what deflating the stored members would have done from the samples
+            samples = [m['sample'] for m in stored if m['sample'] is not None]
+            sample_in = sum(sample[0] for sample in samples)
+            would_save = size * (sample_in - sum(sample[1] for sample in samples)) / sample_in if sample_in else 0
+            would_take = size * sum(sample[2] for sample in samples) / sample_in if sample_in else 0.0
+            lines.append('Stored %s member(s) (%s) as-is; deflating them would have saved ~%s '
+                         '(%.1f%%) for ~%.2fs of CPU time.' % (
+                len(stored), _formatBytes(size), _formatBytes(would_save),
+                100 * would_save / size if size else 0, would_take))
+        if self.transcoded:
+            lines.append('Transcoded %s audio file(s): %s -> %s.' % (len(self.transcoded),
+                _formatBytes(sum(before for source, before, after in self.transcoded)),
+                _formatBytes(sum(after for source, before, after in self.transcoded))))
+        if self.generated_textures:
+            lines.append('Generated %s record texture(s).' % self.generated_textures)
+        if self.optimized:
+            lines.append('Optimized %s texture(s): %s -> %s.' % (len(self.optimized),
+                _formatBytes(sum(before for source, before, after in self.optimized)),
+                _formatBytes(sum(after for source, before, after in self.optimized))))
+        if self.stripped:
+            lines.append('Stripped metadata from %s Ogg file(s), saving %s.' % (len(self.stripped),
+                _formatBytes(sum(before - after for source, before, after in self.stripped))))
+        if self.reused:
+            lines.append('Copied %s unchanged member(s) from the previous build.' % self.reused)
+        if self.shared_audio:
+            lines.append('Reused identical audio for %s record(s), saving %s.' % (
+                self.shared_audio, _formatBytes(self.audio_saved)))
+        if self.sha1 is not None:
+            lines.append('SHA-1: %s' % self.sha1)
+        lines.extend('Warning: ' + warning for warning in self.warnings)
+        if self.cache is not None:
+            lines.append('Cache: %s hit(s) (%s not recompressed), %s miss(es).' % (
+                self.cache.hits, _formatBytes(self.cache.bytes_hit), self.cache.misses))
+        return lines
+
+def _formatBytes(size):
+    '''Human readable size'''
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            break
+        size /= 1024
+    return '%.1f %s' % (size, unit) if unit != 'B' else '%d B' % size
+
+def _planAudio(music, hashes=None):
+    '''Work out which sound file each record plays, storing identical audio once.
+    Audio used by several records (or whose filename clashes with different audio)
+    is named after a hash of its content.
+    hashes, if given, remembers content hashes by file path and stat, across builds.
+    Returns ({record name : sound name}, [(file name in pack, path)], bytes saved).'''
+    from collections import OrderedDict
+
+    def hashFile(path):
+        if hashes is None:
+            return pack_cache.hashFile(path)
+        identity = _memberIdentity(path)
+        if identity not in hashes:
+            hashes[identity] = pack_cache.hashFile(path)
+        return hashes[identity]
+
+    # records using each file
+    users = OrderedDict()
+    for name, info in music.items():
+        users.setdefault(Path(info['audioPath']).resolve(), list()).append(name)
+
+    # only files of the same size can be identical, and only clashing names need telling apart
+    by_size = dict()
+    by_filename = dict()
+    for path in users:
+        by_size.setdefault(path.stat().st_size, list()).append(path)
+        by_filename.setdefault(path.name.lower(), list()).append(path)
+    digests = dict()
+    for group in list(by_size.values()) + list(by_filename.values()):
+        if len(group) > 1:
+            for path in group:
+                if path not in digests:
+                    digests[path] = hashFile(path)
+
+    contents = OrderedDict()
+    for path in users:
+        contents.setdefault(digests.get(path, path), list()).append(path)
+
+    sounds = dict()
+    files = list()
+    saved = 0
+    for key, paths in contents.items():
+        path = paths[0]
+        names = [name for p in paths for name in users[p]]
+        clashes = any(digests.get(other, other) != key for other in by_filename[path.name.lower()])
+        if len(names) > 1 or clashes:
+            sound = digests.get(path) or hashFile(path)
+            sound = sound[:16]
+        else:
+            sound = path.stem
+        files.append((sound + path.suffix, path))
+        for name in names:
+            sounds[name] = sound
+        saved += path.stat().st_size * (len(names) - 1)
+    return sounds, files, saved
+
+def _packMembers(music, pack_info=dict(), audio=None):
+    '''List everything that goes in the pack as (path in pack, source) pairs,
+    where source is either text to write or the Path of a file to copy in.
+    audio is a plan from _planAudio; without one every record gets its own file.'''
+    if audio is None:
+        sounds = None
+        audio_files = [(Path(info['audioPath']).name, Path(info['audioPath']))
+                       for info in music.values()]
+    else:
+        sounds, audio_files, saved = audio
+    members = list(_makeTextContents(music, pack_info, sounds).items())
+
+    # pack cover picture - > pack.png
+    packTexturePath = pack_info.get('thumbnailPath')
+    if packTexturePath is not None and Path(packTexturePath).exists():
+        members.append(('pack.png', Path(packTexturePath)))
+
+    # audio files -> assets\musica\sounds\records\*
+    for filename, audioPath in audio_files:
+        members.append(('assets/musica/sounds/records/%s' % filename, audioPath))
+
+    # texture files -> assets\musica\textures\items\record_[audio filename].png
+    for name, info in music.items():
+        members.append(('assets/musica/textures/items/record_%s.png' % name, Path(info['texturePath'])))
+    return members
+
+def _partFile(path):
+    '''Make a new, empty file beside path to write it in before replace()ing it into
+    place. Each gets a name of its own, so builds of the same pack at once can't
+    write into or replace each other's. Unlike mkstemp's, it gets the usual
+    permissions, which the finished file keeps.'''
+    from os import open as os_open, close, O_CREAT, O_EXCL, O_WRONLY
+    from secrets import token_hex
+    path = Path(path)
+    while True:
+        partpath = path.with_name('.%s.%s.part' % (path.name, token_hex(4)))
+        try:
+            close(os_open(str(partpath), O_CREAT | O_EXCL | O_WRONLY, 0o666))
+        except FileExistsError:
+            continue
+        return partpath
+
+def _packZipPath(pack_info, outputdir=None):
+    '''Where the pack named in pack_info gets written'''
+    if outputdir is None:
+        outputdir = Path.cwd()
+    # appended rather than with_suffix, which would cut "Pack v1.2" down to "Pack v1"
+    return Path(outputdir) / (Path(pack_info['packName']).name + '.rpack.zip')
+
+def _memberIdentity(source):
+    '''What a member is made from, cheaply: its text, or its file's path and stat'''
+    if isinstance(source, str):
+        return source
+    st = source.stat()
+    return (str(source), st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _writePackZip(members, zippath, policy=None, jobs=1, cache=None, pool=None, strip=None,
+                  events=None, cancel=None, stages=None, fileobj=None, previous=None,
+                  reproducible=None):
+    '''Stream the pack members straight into a zip file, with no staging folder.
+    The zip is written to a file of its own beside zippath first, so a failed build
+    leaves nothing behind and builds of the same pack at once don't clash.
+    Given a seekable binary fileobj, the zip is written into that instead (from
+    where it is) and zippath can be None; what is in fileobj after a failure is undefined.
+
+    With jobs > 1, files that get deflated are compressed in a pool of processes
+    a few members ahead of the writer, then spliced in raw, in the same order;
+    the zip is byte for byte what a serial build makes. A process pool can be
+    passed in to share it between several builds.
+
+    With a pack_cache.MemberCache, deflated files found in it are spliced in from
+    the cache instead of being compressed again, and new ones are added to it.
+
+    With pack_ogg.StripSettings, .ogg members have their metadata stripped as
+    they are read.
+
+    The totals, and each member going in, are sent to events (a pack_events.BuildEvents).
+    Setting the threading.Event cancel stops the build between members with
+    BuildCancelled, leaving nothing behind.
+
+    Each stage is timed into stages (a StageTimes, carried on from the caller's
+    if given), which the report keeps.
+
+    Given the report of an earlier build of the same pack as previous (an empty
+    BuildReport for the first), members made from the same text or the same
+    unchanged file, with the same settings, are copied from its zip as they are.
+
+    With ReproducibleSettings, every member gets their timestamp and permissions
+    rather than the files' own or the time of the build.'''
+    from shutil import rmtree
+    if policy is None:
+        policy = CompressionPolicy()
+    if zippath is not None:
+        zippath = Path(zippath)
+    report = BuildReport(zippath)
+    report.cache = cache
+    # no listeners, no events
+    if not events:
+        events = None
+    if stages is not None:
+        report.stages = stages
+    else:
+        report.stages.events = events
+    stages = report.stages
+    partpath = None
+    date_time = localtime()[:6]
+    external_attr = 0o600 << 16
+    if reproducible is not None:
+        date_time = reproducible.date_time
+        external_attr = reproducible.external_attr
+    own_pool = False
+    spooldir = None
+    pending = dict()
+    prevfile = None
+    try:
+        reuse = dict()
+        if previous is not None:
+            stages.start('compare with previous')
+            report.settings = (policy.key(), strip.key() if strip is not None else None,
+                               reproducible.key() if reproducible is not None else None)
+            report.identities = {arcname : _memberIdentity(source) for arcname, source in members}
+            prevpath = previous.zippath
+            if (prevpath is not None and previous.settings == report.settings and prevpath.exists()
+                    and _memberIdentity(prevpath) == previous.zip_identity):
+                prevfile = prevpath.open('rb')
+                raw_members = pack_zip.readRawMembers(prevfile)
+                for i, (arcname, source) in enumerate(members):
+                    if (arcname in raw_members
+                            and previous.identities.get(arcname) == report.identities[arcname]):
+                        reuse[i] = raw_members[arcname]
+        # decide how each member is stored up front, so the pool can run ahead
+        stages.start('choose compression')
+        samples = {m['name'] : m['sample'] for m in previous.members} if reuse else dict()
+        choices = [(reuse[i].compress_type, samples.get(arcname)) if i in reuse
+                   else policy.choose(arcname, source) for i, (arcname, source) in enumerate(members)]
+        transforms = [strip.strip if strip is not None and arcname.lower().endswith('.ogg') else None
+                      for arcname, source in members]
+        to_deflate = [i for i, ((arcname, source), (compress_type, sample))
+                      in enumerate(zip(members, choices))
+                      if compress_type == ZIP_DEFLATED and not isinstance(source, str) and i not in reuse]
+        # look everything up in the cache, only misses get compressed
+        keys = dict()
+        cached = dict()
+        if cache is not None:
+            stages.start('cache lookup')
+            for i in to_deflate:
+                digest = pack_cache.hashFile(members[i][1])
+                if transforms[i] is not None:
+                    digest += ':' + strip.key()
+                keys[i] = cache.key(digest, ZIP_DEFLATED, policy.level)
+                hit = cache.get(keys[i])
+                if hit is not None:
+                    cached[i] = hit
+            to_deflate = [i for i in to_deflate if i not in cached]
+        stages.start('write zip')
+        skip = pack_cache.HEADER_SIZE if cache is not None else 0
+        spooled = set()
+        if to_deflate and (jobs > 1 or cache is not None):
+            from tempfile import mkdtemp
+            spooldir = Path(mkdtemp(prefix='.packotron-',
+                                    dir=str(zippath.parent) if fileobj is None else None))
+            spooled = set(to_deflate)
+            if jobs > 1 and pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                pool = ProcessPoolExecutor(jobs)
+                own_pool = True
+        if jobs <= 1 or not spooled:
+            pool = None
+        to_deflate = iter(to_deflate)
+
+        def submit_ahead():
+            # keep a couple of members per process queued, bounding the spool size
+            while len(pending) < jobs * 2:
+                i = next(to_deflate, None)
+                if i is None:
+                    return
+                pending[i] = pool.submit(pack_zip.deflateToFile, members[i][1],
+                                         spooldir / str(i), policy.level, skip, transforms[i])
+
+        if events is not None:
+            sizes = [len(source.encode('utf-8')) if isinstance(source, str) else source.stat().st_size
+                     for arcname, source in members]
+            events.emit('writeStart', members=len(members), bytes=sum(sizes))
+        from contextlib import nullcontext
+        if fileobj is None:
+            partpath = _partFile(zippath)
+        with partpath.open('wb') if fileobj is None else nullcontext(fileobj) as f:
+            zw = pack_zip.ZipWriter(f)
+            for i, ((arcname, source), (compress_type, sample)) in enumerate(zip(members, choices)):
+                if cancel is not None and cancel.is_set():
+                    raise BuildCancelled('Build cancelled')
+                if events is not None:
+                    events.emit('fileStart', name=arcname, size=sizes[i])
+                start = perf_counter()
+                if pool is not None:
+                    submit_ahead()
+                if i in reuse:
+                    raw = reuse[i]
+                    prevfile.seek(raw.data_offset)
+                    member = zw.writeRaw(arcname, prevfile, raw.crc, raw.file_size, raw.compress_type,
+                                         raw.date_time, raw.external_attr, raw.compress_size)
+                    seconds = perf_counter() - start
+                    report.reused += 1
+                elif i in cached or i in spooled:
+                    if i in cached:
+                        rawpath, crc, size = cached[i]
+                    else:
+                        rawpath = spooldir / str(i)
+                        if i in pending:
+                            crc, size, compress_size, seconds = pending.pop(i).result()
+                        else:
+                            crc, size, compress_size, seconds = pack_zip.deflateToFile(
+                                source, rawpath, policy.level, skip, transforms[i])
+                    if reproducible is None:
+                        file_date_time, file_attr = pack_zip.fileAttributes(source)
+                    else:
+                        file_date_time, file_attr = date_time, external_attr
+                    with rawpath.open('rb') as raw:
+                        raw.seek(skip)
+                        member = zw.writeRaw(arcname, raw, crc, size, ZIP_DEFLATED,
+                                             file_date_time, file_attr)
+                    if i in cached:
+                        seconds = perf_counter() - start
+                    elif cache is not None:
+                        cache.put(keys[i], rawpath, crc, size)
+                    else:
+                        rawpath.unlink()
+                else:
+                    if isinstance(source, str):
+                        member = zw.writeStr(arcname, source.encode('utf-8'), compress_type,
+                                             policy.level, date_time, external_attr)
+                    elif reproducible is not None:
+                        member = zw.writeFile(arcname, source, compress_type, policy.level, date_time,
+                                              external_attr, transform=transforms[i])
+                    else:
+                        member = zw.writeFile(arcname, source, compress_type, policy.level,
+                                              transform=transforms[i])
+                    seconds = perf_counter() - start
+                report.addMember(arcname, member.file_size, member.compress_size, compress_type,
+                                 seconds, sample)
+                if events is not None:
+                    events.emit('fileEnd', name=arcname, size=sizes[i],
+                                compressedSize=member.compress_size,
+                                stored=compress_type == ZIP_STORED, seconds=seconds)
+            zw.close()
+        if prevfile is not None and os_name != 'posix':
+            # it can't be replaced while it's open
+            prevfile.close()
+        if fileobj is None:
+            replace(str(partpath), str(zippath))
+            if previous is not None:
+                report.zip_identity = _memberIdentity(zippath)
+        if prevfile is not None and not prevfile.closed:
+            # freeing a big file's space can take a while, and nothing needs to wait for it
+            from threading import Thread
+            Thread(target=prevfile.close, daemon=True).start()
+            prevfile = None
+    except BaseException:
+        for future in pending.values():
+            future.cancel()
+        if partpath is not None and partpath.exists():
+            partpath.unlink()
+        raise
+    finally:
+        stages.start('clean up')
+        if prevfile is not None:
+            prevfile.close()
+        if own_pool:
+            pool.shutdown()
+        if spooldir is not None:
+            rmtree(str(spooldir), ignore_errors=True)
+        stages.stop()
+    if cache is not None:
+        stages.start('prune cache')
+        cache.prune()
+        stages.stop()
+    return report
+
+def _transcodeAudio(music, settings, cache=None, jobs=1):
+    '''Point tracks at re-encoded copies of any audio that needs it.
+    Returns the new music and [(source, transcoded)] for what was re-encoded.'''
+    cachedir = (cache.directory if cache is not None else pack_cache.defaultCacheDir()) / 'transcoded'
+    transcoded = pack_transcode.transcodeAll(
+        [info['audioPath'] for info in music.values()], settings, cachedir, jobs)
+    if not transcoded:
+        return music, list()
+    music = {name : dict(info, audioPath=transcoded.get(Path(info['audioPath']), info['audioPath']))
+             for name, info in music.items()}
+    return music, list(transcoded.items())
+
+def _generateTextures(music, settings, cache=None):
+    '''Give tracks without a texture of their own (none, or the base texture itself)
+    a variant of the base texture. Returns the new music and how many were given one.'''
+    cachedir = (cache.directory if cache is not None else pack_cache.defaultCacheDir()) / 'textures'
+    base = Path(settings.base).resolve()
+    names = [name for name, info in music.items()
+             if info.get('texturePath') is None or Path(info['texturePath']) == base]
+    if not names:
+        return music, 0
+    generated = pack_textures.generateTextures(settings, names, cachedir)
+    music = {name : dict(info, texturePath=generated[name]) if name in generated else info
+             for name, info in music.items()}
+    return music, len(generated)
+
+def _optimizeTextures(music, pack_info, settings, cache=None, jobs=1):
+    '''Point tracks and the pack thumbnail at optimized copies of their textures.
+    Returns the new music and pack_info, [(source, size before, size after)] and warnings.'''
+    cachedir = (cache.directory if cache is not None else pack_cache.defaultCacheDir()) / 'optimized'
+    items = [(Path(info['texturePath']), settings.size) for info in music.values()]
+    thumbnail = pack_info.get('thumbnailPath')
+    if thumbnail is not None and Path(thumbnail).exists():
+        thumbnail = (Path(thumbnail), settings.thumbnail_size)
+        items.append(thumbnail)
+    else:
+        thumbnail = None
+    optimized = pack_textures.optimizeTextures(items, settings, cachedir, jobs)
+    warnings = list()
+    for item, (path, dimensions) in optimized.items():
+        # what goes in the pack counts, scaling may well have fixed the original
+        warning = pack_textures.dimensionWarning(item[0], *pack_textures.pngSize(path),
+                                                 original=dimensions) if item != thumbnail else None
+        if warning:
+            warnings.append(warning)
+    music = {name : dict(info, texturePath=optimized[(Path(info['texturePath']), settings.size)][0])
+             for name, info in music.items()}
+    if thumbnail is not None:
+        pack_info = dict(pack_info, thumbnailPath=optimized[thumbnail][0])
+    results = [(source, source.stat().st_size, path.stat().st_size)
+               for (source, size), (path, dimensions) in optimized.items()]
+    return music, pack_info, results, warnings
+
+def _makePack(music, pack_info, outputdir, policy=None, jobs=1, cache=None, pool=None,
+              transcode=None, textures=None, optimize=None, strip=None, events=None, cancel=None,
+              profile=False, fileobj=None, previous=None, reproducible=None):
+    '''Use args to make a resource pack.
+    Given fileobj, the zip is written into it rather than into outputdir, and given
+    previous, unchanged members are copied from an earlier build, as for _writePackZip.
+    events and cancel are as for _writePackZip; the build's stages and warnings are
+    sent to events too, and cancel is also checked between stages.
+    Every stage is timed in report.stages; with profile=True, report.peak_memory
+    is measured with tracemalloc too (which slows the build down). When something
+    else is tracing already, the peak would be theirs too, so it is left as None.
+    With ReproducibleSettings as reproducible, the same music and files always
+    make the same zip, whose digests go in report.sha1 and report.sha256.'''
+    if profile:
+        import tracemalloc
+        # someone else may be tracing already, like --profile around a batch of builds;
+        # then the peak is the whole batch's so far, and only they can report it
+        own_trace = not tracemalloc.is_tracing()
+        if own_trace:
+            tracemalloc.start()
+        try:
+            report = _makePack(music, pack_info, outputdir, policy, jobs, cache, pool, transcode,
+                               textures, optimize, strip, events, cancel, fileobj=fileobj,
+                               previous=previous, reproducible=reproducible)
+            if own_trace:
+                report.peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            if own_trace:
+                tracemalloc.stop()
+        return report
+
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            raise BuildCancelled('Build cancelled')
+    # no listeners, no events
+    if not events:
+        events = None
+    if events is not None:
+        events.emit('buildStart', pack=pack_info['packName'])
+    if reproducible is not None:
+        # whatever order the spec or catalog lists them in
+        music = dict(sorted(music.items()))
+    stages = StageTimes(events)
+    generated = 0
+    if textures is not None:
+        stages.start('generate textures')
+        music, generated = _generateTextures(music, textures, cache)
+    missing = [name for name, info in music.items() if info.get('texturePath') is None]
+    if missing:
+        raise ValueError("No texture for track(s) %s; give them one, or generate them from a base texture."
+                         % ', '.join(missing[:5] + (['...'] if len(missing) > 5 else [])))
+    optimized = list()
+    texture_warnings = list()
+    check_cancel()
+    if optimize is not None:
+        stages.start('optimize textures')
+        music, pack_info, optimized, texture_warnings = _optimizeTextures(
+            music, pack_info, optimize, cache, jobs)
+    transcoded = list()
+    check_cancel()
+    if transcode is not None:
+        stages.start('transcode')
+        music, transcoded = _transcodeAudio(music, transcode, cache, jobs)
+    check_cancel()
+    stages.start('plan audio')
+    audio_hashes = None
+    if previous is not None:
+        audio_hashes = dict(previous.audio_hashes or ())
+    audio = _planAudio(music, audio_hashes)
+    sounds, audio_files, audio_saved = audio
+    # preflight: check the audio really is something Minecraft can play
+    stages.start('inspect audio')
+    known = dict()
+    audio_identities = None
+    if previous is not None:
+        audio_identities = {filename : _memberIdentity(path) for filename, path in audio_files}
+        # audio that hasn't changed since the previous build needn't be looked at again
+        known = {path : previous.audio[filename] for filename, path in audio_files
+                 if filename in previous.audio
+                 and (previous.audio_identities or dict()).get(filename) == audio_identities[filename]}
+    audio_info = pack_ogg.inspectAll([path for filename, path in audio_files if path not in known],
+                                     max(4, jobs))
+    audio_info.update(known)
+    stages.start('text files')
+    members = _packMembers(music, pack_info, audio)
+    if reproducible is not None:
+        members.sort(key=lambda member: member[0])
+    report = _writePackZip(members, _packZipPath(pack_info, outputdir) if fileobj is None else None,
+                           policy, jobs, cache, pool, strip, events, cancel, stages, fileobj, previous,
+                           reproducible)
+    if reproducible is not None and report.zippath is not None:
+        stages.start('hash')
+        with report.zippath.open('rb') as f:
+            report.sha256, report.sha1 = _hashPack(f)
+    stages.start('report')
+    report.audio_saved = audio_saved
+    report.audio_hashes = audio_hashes
+    report.audio_identities = audio_identities
+    if strip is not None:
+        sizes = {m['name'] : m['size'] for m in report.members}
+        for filename, path in audio_files:
+            before = path.stat().st_size
+            after = sizes['assets/musica/sounds/records/%s' % filename]
+            if after < before:
+                report.stripped.append((path, before, after))
+                continue
+            problem = pack_ogg.commentProblem(path)
+            if problem is not None:
+                report.warnings.append("Couldn't strip the metadata from '%s', %s; it went in as it is."
+                                       % (path, problem))
+    for filename, path in audio_files:
+        info = audio_info[path]
+        report.audio[filename] = info
+        if info.get('error'):
+            report.warnings.append("Couldn't read '%s': %s" % (path, info['error']))
+        elif info['codec'] is None:
+            report.warnings.append("'%s' isn't an Ogg file, Minecraft won't play it." % path)
+        elif info['codec'] != 'vorbis':
+            report.warnings.append("'%s' is Ogg %s, not Vorbis, Minecraft won't play it."
+                                   % (path, info['codec'].title()))
+    report.shared_audio = len(music) - len(audio_files)
+    report.transcoded = [(source, source.stat().st_size, path.stat().st_size)
+                         for source, path in transcoded]
+    report.generated_textures = generated
+    report.optimized = optimized
+    report.warnings.extend(texture_warnings)
+    stages.stop()
+    if events is not None:
+        for warning in report.warnings:
+            events.emit('warning', message=warning)
+        events.emit('buildEnd', zip=str(report.zippath) if report.zippath is not None else None)
+    return report
+
+_OPTION_KEYS = ('compression', 'transcode', 'textures', 'optimizeTextures', 'stripMetadata',
+                'reproducible')
+
+def _specOptions(info, base=None):
+    '''Pick the build options out of a spec, resolving any paths in them from base'''
+    options = {key : dict(info[key]) for key in _OPTION_KEYS if key in info}
+    if 'textures' in options and base is not None:
+        options['textures']['base'] = str((Path(base) / options['textures']['base']).resolve())
+    return options
+
+def _mergeOptions(options, overrides):
+    '''Spec options with overrides (from the command line) laid over them'''
+    merged = {key : dict(value) for key, value in options.items()}
+    for key, value in overrides.items():
+        merged.setdefault(key, dict()).update(value)
+    return merged
+
+def _optionSettings(options):
+    '''Turn build options into the settings keyword arguments for _makePack'''
+    transcode = options.get('transcode')
+    textures = options.get('textures')
+    optimize = options.get('optimizeTextures')
+    strip = options.get('stripMetadata')
+    reproducible = options.get('reproducible')
+    return {
+        'policy' : CompressionPolicy.fromInfo(options.get('compression')),
+        'transcode' : pack_transcode.TranscodeSettings.fromInfo(transcode) if transcode is not None else None,
+        'textures' : pack_textures.TextureSettings.fromInfo(textures) if textures is not None else None,
+        'optimize' : pack_textures.OptimizeSettings.fromInfo(optimize) if optimize is not None else None,
+        'strip' : pack_ogg.StripSettings.fromInfo(strip) if strip is not None else None,
+        'reproducible' : ReproducibleSettings.fromInfo(reproducible) if reproducible is not None else None,
+        }
+
+def _trackInfo(track, base, resolved=None):
+    '''Fill in a track from a spec with the default infos, resolving its paths from base.
+    resolved memoizes paths already seen, since catalogs tend to reuse textures.'''
+    if resolved is None:
+        resolved = dict()
+    info = {
+        'description' : Path(track['audioPath']).stem,
+        'hasLore' : False,
+        'isShiny' : False,
+        'useSpecialName' : False,
+        }
+    info.update(track)
+    for key in ('audioPath', 'texturePath'):
+        if info.get(key) is None:
+            # no texture, one gets generated
+            info[key] = None
+            continue
+        path = str(info[key])
+        if path not in resolved:
+            resolved[path] = (base / path).resolve()
+        info[key] = resolved[path]
+    return info
+
+def _loadJsonSpec(jsonpath):
+    '''Read a JSON file into (music, pack_info, outputdir, options), where options
+    holds its "compression" and "transcode" settings, if any.
+    Relative paths in it are taken from the JSON file's folder.'''
+    from json import load
+    jsonpath = Path(jsonpath).resolve()
+    with jsonpath.open('r') as jf:
+        jsoninfo = load(jf)
+    return _parseSpec(jsoninfo, jsonpath.parent)
+
+def _parseSpec(jsoninfo, base):
+    '''A spec already read from JSON into (music, pack_info, outputdir, options),
+    taking relative paths in it from base'''
+    base = Path(base)
+    pack_info = dict(jsoninfo.get('pack_info', {}))
+    if pack_info.get('thumbnailPath') is not None:
+        pack_info['thumbnailPath'] = (base / pack_info['thumbnailPath']).resolve()
+    outputdir = (base / jsoninfo.get('outputdir', r'./')).resolve()
+
+    music = dict()
+    names = NameAllocator()
+    resolved = dict()
+    for track in jsoninfo['music']:
+        music[names.allocate(_processFilename(Path(track['audioPath']).stem))] = _trackInfo(
+            track, base, resolved)
+    return music, pack_info, outputdir, _specOptions(jsoninfo, base)
+
+_CATALOG_SUFFIXES = ('.jsonl', '.ndjson', '.csv')
+
+def _iterCatalog(catalogpath):
+    '''Stream the entries of a track catalog, one dict at a time.
+
+    JSON Lines catalogs have one track object per line; a line with a "pack_info"
+    (and maybe "outputdir", "compression" or "transcode") key sets up the pack instead.
+    CSV catalogs have a header row naming the track keys (audioPath, texturePath,
+    description, lore, specialName, hasLore, isShiny, useSpecialName).'''
+    from json import loads
+    catalogpath = Path(catalogpath)
+    if catalogpath.suffix.lower() == '.csv':
+        import csv
+        flags = ('hasLore', 'isShiny', 'useSpecialName')
+        with catalogpath.open('r', newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                track = {key : value for key, value in row.items() if key and value}
+                for flag in flags:
+                    if flag in track:
+                        track[flag] = track[flag].strip().lower() in ('1', 'true', 'yes', 'y')
+                yield track
+    else:
+        with catalogpath.open('r', encoding='utf-8-sig') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield loads(line)
+                except ValueError as e:
+                    raise ValueError('%s, line %s: %s' % (catalogpath.name, lineno, e))
+
+def _loadCatalog(catalogpath):
+    '''Read a JSON Lines or CSV track catalog into (music, pack_info, outputdir, options),
+    a line at a time. Packs without pack info are named after the catalog file.'''
+    catalogpath = Path(catalogpath).resolve()
+    base = catalogpath.parent
+    pack_info = {'packName' : catalogpath.stem}
+    outputdir = base
+    options = dict()
+    music = dict()
+    names = NameAllocator()
+    resolved = dict()
+    for entry in _iterCatalog(catalogpath):
+        if 'pack_info' in entry:
+            pack_info.update(entry['pack_info'])
+            if pack_info.get('thumbnailPath') is not None:
+                pack_info['thumbnailPath'] = (base / pack_info['thumbnailPath']).resolve()
+            outputdir = (base / entry.get('outputdir', r'./')).resolve()
+            options.update(_specOptions(entry, base))
+            continue
+        music[names.allocate(_processFilename(Path(entry['audioPath']).stem))] = _trackInfo(
+            entry, base, resolved)
+    return music, pack_info, outputdir, options
+
+def _loadSpec(specpath):
+    '''Load a JSON file, or a JSON Lines/CSV catalog, going by its suffix'''
+    if Path(specpath).suffix.lower() in _CATALOG_SUFFIXES:
+        return _loadCatalog(specpath)
+    return _loadJsonSpec(specpath)
+
+def _expandJsonPaths(patterns):
+    '''Turn JSON file arguments (files, globs or folders of .json files) into a list of files'''
+    from glob import glob
+    paths = list()
+    seen = set()
+    for pattern in map(str, patterns):
+        if Path(pattern).is_dir():
+            found = sorted(Path(pattern).glob('*.json'))
+        elif any(c in pattern for c in '*?['):
+            found = sorted(map(Path, glob(pattern, recursive=True)))
+        else:
+            found = [Path(pattern)]
+        for path in found:
+            path = path.absolute()
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+def _estimateTrackSizes(music, settings):
+    '''Roughly how many bytes each track adds to a pack, going by how the compression
+    policy in settings (from _optionSettings) would store its files: its audio and
+    texture, their zip entries, and a generous share of the text files.
+    Transcoding and optimizing textures only make this an overestimate.'''
+    # a policy of its own, so the build's still samples files for its report
+    policy = settings['policy']
+    policy = CompressionPolicy(policy.rules, policy.level, policy.threshold, policy.sample_size)
+    base = settings['textures'].base if settings['textures'] is not None else None
+    sizes = dict()
+    for name, info in music.items():
+        # record-pack.json, sounds.json and en_US.lang entries, before they are deflated
+        size = 400 + 4 * len(name) + sum(len(info.get(key) or '') for key in ('description', 'lore', 'specialName'))
+        texture = info.get('texturePath') or base
+        for arcname, path in (('assets/musica/sounds/records/%s' % Path(info['audioPath']).name, info['audioPath']),
+                              ('assets/musica/textures/items/record_%s.png' % name, texture)):
+            if path is None:
+                continue
+            path = Path(path)
+            file_size = path.stat().st_size
+            compress_type, sample = policy.choose(arcname, path)
+            if compress_type == ZIP_DEFLATED:
+                sample = sample or policy._sample(path)
+                if sample[0]:
+                    file_size = -(-file_size * sample[1] // sample[0])
+            # local and central headers, with room for a zip64 extra field
+            size += file_size + 2 * (30 + len(arcname.encode('utf-8'))) + 16 + 28
+        sizes[name] = size
+    return sizes
+
+def _assignShards(sizes, limit, previous=dict()):
+    '''Split tracks into shards of at most limit bytes, giving {name : shard index}.
+    Tracks stay in the shard previous (an earlier assignment) gave them while it still
+    has room, so adding or removing tracks doesn't move the others; the rest go into the
+    first shard with room, biggest first.'''
+    too_big = [name for name, size in sizes.items() if size > limit]
+    if too_big:
+        raise ValueError("Track '%s' alone is bigger than the largest pack allowed" % too_big[0])
+    assignment = dict()
+    used = list()
+    unplaced = list()
+    for name in sizes:
+        shard = previous.get(name)
+        if shard is not None:
+            used.extend([0] * (shard + 1 - len(used)))
+            if used[shard] + sizes[name] <= limit:
+                used[shard] += sizes[name]
+                assignment[name] = shard
+                continue
+        unplaced.append(name)
+    for name in sorted(unplaced, key=lambda name: (-sizes[name], name)):
+        shard = next((i for i, size in enumerate(used) if size + sizes[name] <= limit), len(used))
+        if shard == len(used):
+            used.append(0)
+        used[shard] += sizes[name]
+        assignment[name] = shard
+    return assignment
+
+def _shardSpec(music, pack_info, outputdir, settings, max_size):
+    '''Split a spec into packs of at most max_size bytes, named "<pack name> - Part <n>".
+    Which track went in which pack is kept beside them in "<pack name>.shards.json", and
+    kept to the next time. Returns ([(music, pack_info)] for each pack, manifest), where
+    manifest is for _saveShardManifest once every pack has been built.'''
+    from json import load
+    manifestpath = Path(outputdir) / (Path(pack_info['packName']).name + '.shards.json')
+    previous = dict()
+    if manifestpath.exists():
+        with manifestpath.open('r') as f:
+            previous = load(f).get('shards', dict())
+    # what every pack has besides its tracks: the thumbnail and the text files' skeletons
+    overhead = 4096
+    if pack_info.get('thumbnailPath') is not None and Path(pack_info['thumbnailPath']).exists():
+        overhead += Path(pack_info['thumbnailPath']).stat().st_size + 100
+    assignment = _assignShards(_estimateTrackSizes(music, settings), max_size - overhead, previous)
+    shards = list()
+    for shard in sorted(set(assignment.values())):
+        shard_music = {name : info for name, info in music.items() if assignment[name] == shard}
+        shards.append((shard_music, dict(pack_info, packName='%s - Part %s' % (pack_info['packName'], shard + 1))))
+    # parts the last build made that no track is in any more
+    stale = [_packZipPath(dict(pack_info, packName='%s - Part %s' % (pack_info['packName'], shard + 1)),
+                          outputdir)
+             for shard in sorted(set(previous.values()) - set(assignment.values()))]
+    return shards, (manifestpath, {'maxPackSize' : max_size, 'shards' : assignment}, stale)
+
+def _saveShardManifest(manifest):
+    '''Save a split pack's manifest from _shardSpec, once its packs are all built, and
+    remove the packs left over from an earlier split into more parts. Returns the
+    paths of the packs removed.'''
+    from json import dumps
+    manifestpath, content, stale = manifest
+    partpath = manifestpath.with_name(manifestpath.name + '.part')
+    with partpath.open('w') as f:
+        f.write(dumps(content, indent=4))
+    replace(str(partpath), str(manifestpath))
+    removed = [zippath for zippath in stale if zippath.exists()]
+    for zippath in removed:
+        zippath.unlink()
+    return removed
+
+def _buildJsonSpecs(jsonpaths, overrides=dict(), jobs=1, cache=None, workers=None, profile=False,
+                    cprofiles=None, max_pack_size=None):
+    '''Build a pack from each JSON file, several at once, without changing directory.
+    overrides are options laid over what the JSON files say. Yields (jsonpath, report, seconds)
+    as packs finish, with the exception that stopped a pack in place of its report.
+    profile is passed on to _makePack; given a list as cprofiles, each build runs
+    under a cProfile.Profile of its own (they run in threads), added to the list.
+    Given max_pack_size in bytes, each spec is split into packs no bigger (see _shardSpec),
+    each yielded on its own; which track went where is only saved once all of a spec's
+    packs have been built.'''
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    # load everything first, so two specs writing the same pack can be caught
+    specs = list()
+    zippaths = dict()
+    # jsonpath : [shard manifest, packs still building, whether one failed]
+    manifests = dict()
+    for jsonpath in jsonpaths:
+        try:
+            music, pack_info, outputdir, options = _loadSpec(jsonpath)
+            options = _mergeOptions(options, overrides)
+            packs = [(music, pack_info)]
+            manifest = None
+            if max_pack_size is not None:
+                packs, manifest = _shardSpec(music, pack_info, outputdir, _optionSettings(options),
+                                             max_pack_size)
+            # settings of their own for each pack, since they build side by side
+            spec_packs = [(jsonpath, music, pack_info, outputdir, _optionSettings(options))
+                          for music, pack_info in packs]
+            for music, pack_info in packs:
+                zippath = _packZipPath(pack_info, outputdir)
+                if zippath in zippaths:
+                    raise ValueError("'%s' is also written by '%s'" % (zippath, zippaths[zippath]))
+                zippaths[zippath] = jsonpath
+        except Exception as e:
+            yield jsonpath, e, 0.0
+            continue
+        specs.extend(spec_packs)
+        if manifest is not None:
+            manifests[jsonpath] = [manifest, len(spec_packs), False]
+    if not specs:
+        return
+
+    def build(spec):
+        jsonpath, music, pack_info, outputdir, settings = spec
+        start = perf_counter()
+        if cprofiles is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                cprofiles.append(profiler)
+            except ValueError:
+                # Python 3.12 on profiles every thread at once, the first profiler covers this one
+                profiler = None
+        try:
+            report = _makePack(music, pack_info, outputdir, jobs=jobs, cache=cache, pool=pool,
+                               profile=profile, **settings)
+            if max_pack_size is not None and report.zippath.stat().st_size > max_pack_size:
+                report.warnings.append('The pack came out at %s, over the %s it was meant to fit in.'
+                                       % (_formatBytes(report.zippath.stat().st_size), _formatBytes(max_pack_size)))
+        except Exception as e:
+            report = e
+        finally:
+            if cprofiles is not None and profiler is not None:
+                profiler.disable()
+        return jsonpath, report, perf_counter() - start
+
+    pool = None
+    if jobs > 1:
+        # one process pool shared by every pack, rather than one each
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(jobs)
+    try:
+        with ThreadPoolExecutor(workers or min(len(specs), cpu_count() or 1)) as executor:
+            for future in as_completed([executor.submit(build, spec) for spec in specs]):
+                jsonpath, report, seconds = future.result()
+                if jsonpath in manifests:
+                    waiting = manifests[jsonpath]
+                    waiting[1] -= 1
+                    waiting[2] = waiting[2] or isinstance(report, Exception)
+                    if not waiting[1] and not waiting[2]:
+                        try:
+                            for zippath in _saveShardManifest(waiting[0]):
+                                report.warnings.append("Removed '%s', a part no longer needed." % zippath.name)
+                        except OSError as e:
+                            report.warnings.append("Couldn't save which part each track is in: %s" % e)
+                yield jsonpath, report, seconds
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def _hashPack(f, end=None):
+    '''(SHA-256, SHA-1) of a zip, read from where the binary file f is to end, or its end'''
+    import hashlib
+    sha256 = hashlib.sha256()
+    sha1 = hashlib.sha1()
+    while end is None or f.tell() < end:
+        chunk = f.read(pack_zip.CHUNK_SIZE if end is None else min(pack_zip.CHUNK_SIZE, end - f.tell()))
+        if not chunk:
+            break
+        sha256.update(chunk)
+        sha1.update(chunk)
+    return sha256.hexdigest(), sha1.hexdigest()
+
+class BuildResult:
+    '''What build_pack made: where the pack went (path, None if it went to a file
+    object), its size in bytes, SHA-256 and SHA-1 (as Minecraft servers want for
+    resource packs), how long it took in seconds, the time spent in each stage,
+    and the full BuildReport.'''
+
+    def __init__(self, path, size, sha256, seconds, report, sha1=None):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.sha1 = sha1
+        self.seconds = seconds
+        self.report = report
+
+    @property
+    def stages(self):
+        return self.report.stages.stages
+
+    @property
+    def warnings(self):
+        return self.report.warnings
+
+    def summary(self):
+        '''Lines of text describing the build'''
+        return self.report.summary()
+
+def build_pack(spec, output=None, options=None, base=None, jobs=1, cache=None, pool=None,
+               events=None, cancel=None, profile=False):
+    '''Build a resource pack, and return a BuildResult.
+
+    spec is the path of a JSON spec or catalog (relative paths in it are taken
+    from its folder), or a spec already loaded as a dict (relative paths in it are
+    taken from base, the current folder if not given).
+
+    output is where the pack goes: None for where the spec says, a folder to put
+    it in, a file path, or a binary file object (such as a BytesIO) to write it
+    into. File objects that can't seek are written through a temporary file.
+
+    options are laid over the spec's own (as "compression", "transcode", ... in a
+    JSON spec). jobs, cache, pool, events and cancel are as for the command line's
+    builds: processes to compress with, a pack_cache.MemberCache, a process pool to
+    share, a pack_events.BuildEvents to report to and a threading.Event to stop it.
+    With profile=True, the report's peak_memory is measured too (unless something
+    else is tracing already, see _makePack), and result.report.profile() gives the
+    whole breakdown, as for --profile.
+
+    Nothing global is touched, so packs can be built from several threads at once;
+    only profile=True starts tracemalloc, which traces the whole process.'''
+    start = perf_counter()
+    if isinstance(spec, dict):
+        music, pack_info, outputdir, spec_options = _parseSpec(spec, base if base is not None else Path.cwd())
+    else:
+        music, pack_info, outputdir, spec_options = _loadSpec(spec)
+    settings = _optionSettings(_mergeOptions(spec_options, options or dict()))
+    if output is None or isinstance(output, (str, Path)):
+        if output is None or Path(output).is_dir():
+            report = _makePack(music, pack_info, output if output is not None else outputdir, jobs=jobs,
+                               cache=cache, pool=pool, events=events, cancel=cancel, profile=profile,
+                               **settings)
+        else:
+            # a file of its own name, written beside it first like any other pack
+            output = Path(output)
+            partpath = _partFile(output)
+            try:
+                with partpath.open('wb') as f:
+                    report = _makePack(music, pack_info, output.parent, jobs=jobs, cache=cache,
+                                       pool=pool, events=events, cancel=cancel, profile=profile,
+                                       fileobj=f, **settings)
+                replace(str(partpath), str(output))
+            except BaseException:
+                if partpath.exists():
+                    partpath.unlink()
+                raise
+            report.zippath = output
+        sha256, sha1 = report.sha256, report.sha1
+        if sha256 is None:
+            with report.zippath.open('rb') as f:
+                sha256, sha1 = _hashPack(f)
+        return BuildResult(report.zippath, report.zippath.stat().st_size, sha256,
+                           perf_counter() - start, report, sha1)
+
+    seekable = getattr(output, 'seekable', lambda: False)()
+    readable = getattr(output, 'readable', lambda: False)()
+    if seekable and readable:
+        # like a BytesIO: write straight in, then read it back to hash
+        offset = output.tell()
+        report = _makePack(music, pack_info, outputdir, jobs=jobs, cache=cache, pool=pool,
+                           events=events, cancel=cancel, profile=profile, fileobj=output,
+                           **settings)
+        end = output.tell()
+        output.seek(offset)
+        sha256, sha1 = _hashPack(output, end)
+        size = end - offset
+    else:
+        # the zip needs to go back and fill in headers, so build it somewhere that can
+        from tempfile import SpooledTemporaryFile
+        with SpooledTemporaryFile(64 * 1024**2) as spool:
+            report = _makePack(music, pack_info, outputdir, jobs=jobs, cache=cache, pool=pool,
+                               events=events, cancel=cancel, profile=profile, fileobj=spool,
+                               **settings)
+            size = spool.tell()
+            spool.seek(0)
+            sha256, sha1 = _hashPack(spool)
+            spool.seek(0)
+            pack_zip.copyStream(spool, output)
+    return BuildResult(None, size, sha256, perf_counter() - start, report, sha1)
+
+def _cliOverrides(args):
+    '''The build options given on the command line, to lay over a spec's own'''
+    # command line options win over the JSON file
+    overrides = {'compression' : dict()}
+    if args.compression_rules is not None:
+        overrides['compression']['rules'] = args.compression_rules
+    if args.compression_level is not None:
+        overrides['compression']['level'] = args.compression_level
+    transcode = {key : value for key, value in (('quality', args.quality), ('bitrate', args.bitrate),
+                 ('maxBitrate', args.max_bitrate), ('encoder', args.encoder)) if value is not None}
+    if args.transcode or transcode:
+        overrides['transcode'] = transcode
+    if args.generate_textures is not None:
+        overrides['textures'] = {'base' : str(args.generate_textures.resolve())}
+    if args.texture_mode is not None:
+        overrides.setdefault('textures', dict())['mode'] = args.texture_mode
+    if args.optimize_textures or args.texture_size is not None:
+        overrides['optimizeTextures'] = dict()
+    if args.texture_size is not None:
+        overrides['optimizeTextures']['size'] = args.texture_size
+    if args.strip_metadata or args.max_comment is not None:
+        overrides['stripMetadata'] = dict()
+    if args.max_comment is not None:
+        overrides['stripMetadata']['maxComment'] = args.max_comment
+    if args.reproducible:
+        overrides['reproducible'] = dict()
+    return overrides
 
 def _createArgParser():
+    import argparse
     parser = argparse.ArgumentParser(
         description="Create Resource Packs for use with the Minecraft mod Musica, using specified " \
         + "'.ogg' sound files and '.png' textures for user-defined Records."
@@ -210,17 +1517,135 @@ def _createArgParser():
     # [-o outputdir]
     parser.add_argument('-o', '--outputdir', default=r'./', type=Path,
                         help='Where to output the resource pack.')
+    # [-j jobs]
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='How many processes compress files at once; 0 uses every core (default: 1).')
+    # [--compression-rules RULES]
+    parser.add_argument('--compression-rules', choices=sorted(CompressionPolicy.rulesets),
+                        help="How to pick which files get compressed: 'default' stores .ogg and .png " \
+                        + "(already compressed) and deflates text, 'probe' tries a sample of every file.")
+    # [--compression-level LEVEL]
+    parser.add_argument('--compression-level', type=int, choices=range(10), metavar='{0-9}',
+                        help='The zlib level used for compressed files (default: 6).')
+
+    # transcoding
+    transcode_group = parser.add_argument_group('Transcoding arguments',
+        'Re-encode non-Ogg audio (and Oggs over --max-bitrate) with ffmpeg or oggenc.')
+    # [--transcode]
+    transcode_group.add_argument('--transcode', action='store_true',
+                                 help='Turn transcoding on (implied by the other transcoding options).')
+    # [--quality Q]
+    transcode_group.add_argument('--quality', type=float,
+                                 help='Vorbis quality to encode at, -1 to 10 (default: 4).')
+    # [--bitrate KBPS]
+    transcode_group.add_argument('--bitrate', type=int,
+                                 help='Average bitrate in kbps to encode at, instead of a quality.')
+    # [--max-bitrate KBPS]
+    transcode_group.add_argument('--max-bitrate', type=int,
+                                 help='Oggs with a higher nominal bitrate (kbps) are re-encoded (default: 192).')
+    # [--encoder ENCODER]
+    transcode_group.add_argument('--encoder',
+                                 help='The encoder to run, ffmpeg or oggenc, by name or path.')
+
+    # [--generate-textures BASE] [--texture-mode MODE]
+    parser.add_argument('--generate-textures', type=Path, metavar='BASE',
+                        help='Give tracks without a texture (or with this one) their own ' \
+                        + 'colour of this base record texture. Needs NumPy and Pillow.')
+    parser.add_argument('--texture-mode', choices=('hue', 'palette'),
+                        help="'hue' shifts the base texture's hue by an amount taken from " \
+                        + "the track name, 'palette' picks one of 8 hues by it (default: hue).")
+
+    # [--optimize-textures] [--texture-size SIZE]
+    parser.add_argument('--optimize-textures', action='store_true',
+                        help='Scale textures down, strip their metadata and recompress them ' \
+                        + 'losslessly. Needs NumPy and Pillow.')
+    parser.add_argument('--texture-size', type=int,
+                        help='Largest record texture size, in pixels, for --optimize-textures (default: 16).')
+
+    # [--strip-metadata] [--max-comment BYTES]
+    parser.add_argument('--strip-metadata', action='store_true',
+                        help='Strip cover art and long comments out of Ogg files as they go in the pack.')
+    parser.add_argument('--max-comment', type=int,
+                        help='Longest Ogg comment, in bytes, --strip-metadata keeps (default: 256).')
+
+    # [--reproducible]
+    parser.add_argument('--reproducible', action='store_true',
+                        help='Make the same pack, byte for byte, every time from the same files: records ' \
+                        + 'and files sorted by name, timestamps taken from $SOURCE_DATE_EPOCH (or 1980).')
+
+    # [--profile FILE] [--cprofile FILE]
+    parser.add_argument('--profile', metavar='FILE',
+                        help='Write a JSON report of where the build went (time per stage, size, ratio ' \
+                        + 'and time per pack member, peak memory) to FILE, or - for the screen.')
+    parser.add_argument('--cprofile', type=Path, metavar='FILE',
+                        help='Run the build(s) under cProfile and save the stats to FILE, for pstats.')
+
+    # [--cache] [--cache-dir DIR] [--cache-size MB]
+    parser.add_argument('--cache', action='store_true',
+                        help='Reuse compressed files from earlier builds, from the default cache folder.')
+    parser.add_argument('--cache-dir', type=Path,
+                        help='Use this folder for the cache of compressed files (implies --cache).')
+    parser.add_argument('--cache-size', type=int, default=2048,
+                        help='Least recently used cache entries are removed past this many MB (default: 2048).')
 
     subparsers = parser.add_subparsers(dest='subparser_name',
         help='Choose how to load data to make Resource Pack.')
 
     # JSON file method
     ###########
-    parser_json = subparsers.add_parser('json', help='Load all data from a JSON file.')
-    # jsonfile JSONFILE
-    parser_json.add_argument('jsonfile', type=Path,
-                        help='Specify a JSON file to use for all data.')
+    parser_json = subparsers.add_parser('json', help='Load all data from JSON file(s), one pack each.')
+    # jsonfile [jsonfile ...]
+    parser_json.add_argument('jsonfiles', metavar='jsonfile', nargs='+',
+                        help='Specify a JSON file to use for all data. Several files, globs ' \
+                        + '(like "specs/*.json") or folders of .json files build several packs. ' \
+                        + 'Large track lists can be given as JSON Lines (.jsonl) or .csv catalogs.')
+    # [-w workers]
+    parser_json.add_argument('-w', '--workers', type=int,
+                        help='How many packs to build at once (default: one per core).')
+    # [--watch] [--poll-interval SECONDS]
+    parser_json.add_argument('--watch', action='store_true',
+                        help='Keep running, and rebuild the pack whenever its JSON file or a file ' \
+                        + 'it names changes, copying unchanged files over from the last build.')
+    parser_json.add_argument('--poll-interval', type=float, default=0.5,
+                        help='Seconds between looking for changes with --watch (default: 0.5).')
+    # [--max-pack-size MB]
+    parser_json.add_argument('--max-pack-size', type=float, metavar='MB',
+                        help='Split each pack into parts of at most this many megabytes, named ' \
+                        + '"<pack name> - Part <n>". Tracks keep to the part they were first put in.')
     
+    # Cache maintenance
+    ###########
+    parser_cache = subparsers.add_parser('cache', help='Show or prune the cache of compressed files.')
+    # {stats,prune}
+    parser_cache.add_argument('action', choices=('stats', 'prune'),
+                              help='Show cache statistics, or evict entries down to --max-size.')
+    # [--max-size MB]
+    parser_cache.add_argument('--max-size', type=int,
+                              help='Size in MB to prune the cache down to (default: --cache-size).')
+
+    # Build service
+    ###########
+    parser_serve = subparsers.add_parser('serve', help='Run a local HTTP service that builds packs ' \
+                        + 'from uploaded specs.')
+    # [--host HOST] [--port PORT]
+    parser_serve.add_argument('--host', default='127.0.0.1',
+                              help='Address to listen on (default: 127.0.0.1, this machine only).')
+    parser_serve.add_argument('--port', type=int, default=8000,
+                              help='Port to listen on (default: 8000, 0 for any free one).')
+    # [-w workers] [--queue-size N]
+    parser_serve.add_argument('-w', '--workers', type=int, default=2,
+                              help='How many packs to build at once (default: 2).')
+    parser_serve.add_argument('--queue-size', type=int, default=8,
+                              help='How many jobs can wait for a worker before new ones are ' \
+                              + 'turned away (default: 8).')
+    # [--workdir DIR] [--keep N] [--max-upload MB]
+    parser_serve.add_argument('--workdir', type=Path,
+                              help='Where uploads and packs are kept (default: a temporary folder).')
+    parser_serve.add_argument('--keep', type=int, default=100,
+                              help='How many finished jobs to keep for download (default: 100).')
+    parser_serve.add_argument('--max-upload', type=int, default=256,
+                              help='Largest upload accepted, in MB (default: 256).')
+
     # Command Line method
     ##############
     parser_cl = subparsers.add_parser('cl', help='Specify data via command line arguments.')
@@ -255,7 +1680,36 @@ def _createArgParser():
     # [-d packdescription]
     pack_metadata_group.add_argument('-d', '--packdescription', default='Contains music for Musica',
                                      help='The description of the resource pack.')
-    
+
+    # Editing a finished pack
+    ###########
+    parser_add = subparsers.add_parser('add', help='Add records to a finished .rpack.zip.')
+    parser_remove = subparsers.add_parser('remove', help='Remove records from a finished .rpack.zip.')
+    parser_update = subparsers.add_parser('update', help='Change a record in a finished .rpack.zip.')
+    for edit_parser in (parser_add, parser_remove, parser_update):
+        # pack
+        edit_parser.add_argument('pack', type=Path, help='The .rpack.zip to change.')
+    # -m audiofile [audiofile ...] -t texturefile [texturefile ...] [-l musicdesc ...]
+    parser_add.add_argument('-m', '--audiofiles', type=Path, nargs='+', required=True,
+                            help='The .ogg file(s) to add to the pack.')
+    parser_add.add_argument('-t', '--texturefiles', type=Path, nargs='+', required=True,
+                            help='The .png file(s) to use as their record texture, in the same order.')
+    parser_add.add_argument('-l', '--musicdesc', nargs='+', default=list(),
+                            help='Their record descriptions (default: the file names).')
+    # record [record ...]
+    parser_remove.add_argument('records', nargs='+', metavar='record',
+                               help='Name of a record to remove, as in record-pack.json.')
+    # record [-m audiofile] [-t texturefile] [-l musicdesc]
+    parser_update.add_argument('record', help='Name of the record to change, as in record-pack.json.')
+    parser_update.add_argument('-m', '--audiofile', type=Path, help='New .ogg file for the record.')
+    parser_update.add_argument('-t', '--texturefile', type=Path, help='New .png texture for the record.')
+    parser_update.add_argument('-l', '--musicdesc', help='New description for the record.')
+    for edit_parser in (parser_add, parser_remove, parser_update):
+        # [--compact]
+        edit_parser.add_argument('--compact', action='store_true',
+                                 help='Write the whole pack out again (copying, not recompressing, ' \
+                                 + 'what is in it), dropping the space earlier changes left unused.')
+
     return parser
 
 if __name__ == '__main__':
@@ -263,30 +1717,121 @@ if __name__ == '__main__':
     parser = _createArgParser()
     args = parser.parse_args()
 
-    if args.subparser_name:
+    cache = None
+    if args.cache or args.cache_dir is not None or args.subparser_name == 'cache':
+        cache = pack_cache.MemberCache(args.cache_dir, args.cache_size * 1024**2)
+
+    if args.subparser_name == 'cache':
+        if args.action == 'stats':
+            stats = cache.stats()
+            print("Cache in '%s':" % stats['directory'])
+            print('%s entries, %s of %s' % (stats['entries'], _formatBytes(stats['size']),
+                                            _formatBytes(stats['maxSize'])))
+        else:
+            max_size = args.max_size * 1024**2 if args.max_size is not None else None
+            removed, freed = cache.prune(max_size)
+            print('Removed %s entries, freed %s.' % (removed, _formatBytes(freed)))
+    elif args.subparser_name in ('add', 'remove', 'update'):
+        import pack_edit
+        start = perf_counter()
+        settings = _optionSettings(_cliOverrides(args))
+        try:
+            editor = pack_edit.PackEditor(args.pack)
+            if args.subparser_name == 'add':
+                if len(args.audiofiles) != len(args.texturefiles):
+                    parser.error('give as many textures (-t) as audio files (-m)')
+                for audio, texture, desc in zip_longest(args.audiofiles, args.texturefiles,
+                                                        args.musicdesc[:len(args.audiofiles)]):
+                    print("Adding '%s'." % editor.add(audio, texture, desc))
+            elif args.subparser_name == 'remove':
+                for name in args.records:
+                    editor.remove(name)
+            else:
+                editor.update(args.record, args.audiofile, args.texturefile, args.musicdesc)
+            written, unused = editor.save(settings['policy'], settings['strip'], args.compact)
+        except (OSError, ValueError) as e:
+            print('Error: %s' % e)
+            raise SystemExit(1)
+        print('%s record(s) added, %s removed, %s updated; wrote %s in %.2fs.' % (
+            len(editor.added), len(editor.removed), len(editor.updated), _formatBytes(written),
+            perf_counter() - start))
+        if unused:
+            print('%s of the pack is left over from changes; --compact reclaims it.' % _formatBytes(unused))
+    elif args.subparser_name == 'serve':
+        import pack_server
+        pack_server.serve(args.host, args.port, workdir=args.workdir, workers=args.workers,
+                          queue_size=args.queue_size, options=_cliOverrides(args),
+                          jobs=args.jobs if args.jobs > 0 else cpu_count(), cache=cache,
+                          max_upload=args.max_upload * 1024**2, keep=args.keep)
+    elif args.subparser_name:
+        overrides = _cliOverrides(args)
+        jobs = args.jobs if args.jobs > 0 else cpu_count()
+        profile = args.profile is not None
+        cprofiles = list() if args.cprofile is not None else None
+        import sys
+        stdout = sys.stdout
+        if args.profile == '-':
+            # the profile gets stdout to itself, so it can be piped into anything reading JSON
+            sys.stdout = sys.stderr
+        if profile:
+            # traced for the whole run, so peak memory covers packs built side by side
+            import tracemalloc
+            tracemalloc.start()
+        run_start = perf_counter()
+        built = list()
+
+        if args.subparser_name == 'json' and args.watch:
+            jsonpaths = _expandJsonPaths(args.jsonfiles)
+            if len(jsonpaths) != 1:
+                parser.error('--watch takes one JSON file, not %s' % len(jsonpaths))
+            if args.max_pack_size is not None:
+                parser.error("--watch can't be used with --max-pack-size")
+            import pack_watch
+            try:
+                pack_watch.watch(jsonpaths[0], overrides, jobs, cache, args.poll_interval,
+                                 args.poll_interval)
+            except KeyboardInterrupt:
+                pass
+            raise SystemExit(0)
         if args.subparser_name == 'json':
-            if args.jsonfile.is_file():
-                jsonpath = args.jsonfile.resolve()
-                chdir(str(jsonpath.parent))
+            jsonpaths = _expandJsonPaths(args.jsonfiles)
+            max_pack_size = None
+            if args.max_pack_size is not None:
+                if args.max_pack_size <= 0:
+                    parser.error('--max-pack-size must be more than 0')
+                max_pack_size = int(args.max_pack_size * 1024**2)
+            # one pack to show in full, or a line for each
+            batch = len(jsonpaths) > 1 or max_pack_size is not None
+            if len(jsonpaths) == 1:
                 print('Load JSON file...')
-                with jsonpath.open('r') as jf:
-                    jsoninfo = json.load(jf)
-                pack_info = jsoninfo.get('pack_info', {})
-                outputdir = Path(jsoninfo.get('outputdir', r'./')).resolve()
-
-                music = dict()
-                for track in jsoninfo['music']:
-                    clean_name = _processFilename(Path(track['audioPath']).stem)
-                    music[clean_name] = {
-                        'description' : Path(track['audioPath']).stem,
-                        'hasLore' : False,
-                        'isShiny' : False,
-                        'useSpecialName' : False,
-                        }
-                    music[clean_name].update(track)
-                    music[clean_name]['audioPath'] = Path(music[clean_name]['audioPath']).resolve()
-                    music[clean_name]['texturePath'] = Path(music[clean_name]['texturePath']).resolve()
-            
+            start = perf_counter()
+            failed = list()
+            for jsonpath, report, seconds in _buildJsonSpecs(jsonpaths, overrides, jobs, cache,
+                                                             args.workers, profile, cprofiles,
+                                                             max_pack_size):
+                if isinstance(report, Exception):
+                    failed.append(jsonpath)
+                    print("FAIL '%s': %s" % (jsonpath, report))
+                elif not batch:
+                    built.append(report)
+                    for line in report.summary():
+                        print(line)
+                    print("Pack written in '%s'." % report.zippath.parent)
+                else:
+                    built.append(report)
+                    print("OK   '%s' -> '%s' (%s, %.2fs)" % (jsonpath, report.zippath.name,
+                          _formatBytes(report.totalSize()), seconds))
+                    for warning in report.warnings:
+                        print('     Warning: ' + warning)
+            if batch:
+                seconds = perf_counter() - start
+                size = sum(report.totalSize() for report in built)
+                print('Built %s of %s pack(s), %s in %.2fs (%.1f packs/s, %s/s).' % (
+                    len(built), len(built) + len(failed), _formatBytes(size), seconds,
+                    len(built) / seconds if seconds else 0,
+                    _formatBytes(size / seconds if seconds else 0)))
+            if not jsonpaths:
+                print('No JSON files found.')
         elif args.subparser_name == 'cl':
             # get names, data etc
             audioPaths = args.audiofiles
@@ -305,8 +1850,51 @@ if __name__ == '__main__':
 
             music = _fillInfo(audioPaths, texturePaths, fileinfo)
 
-        _makePack(music, pack_info, outputdir)
-        print("Pack written in '%s'." % outputdir)
+            if cprofiles is not None:
+                import cProfile
+                cprofiles.append(cProfile.Profile())
+                cprofiles[0].enable()
+            try:
+                report = _makePack(music, pack_info, outputdir, jobs=jobs, cache=cache, profile=profile,
+                                   **_optionSettings(overrides))
+            finally:
+                if cprofiles is not None:
+                    cprofiles[0].disable()
+            built.append(report)
+            for line in report.summary():
+                print(line)
+            print("Pack written in '%s'." % outputdir)
+
+        if profile:
+            results = {
+                'command' : args.subparser_name,
+                'jobs' : jobs,
+                'wall' : perf_counter() - run_start,
+                'peakMemory' : tracemalloc.get_traced_memory()[1],
+                # the whole run is traced, so peak memory is only known for all of it
+                'packs' : [{key : value for key, value in report.profile().items() if key != 'peakMemory'}
+                           for report in built],
+                }
+            if args.subparser_name == 'json':
+                results['failed'] = [str(jsonpath) for jsonpath in failed]
+            tracemalloc.stop()
+            from json import dumps
+            text = dumps(results, indent=4)
+            if args.profile == '-':
+                print(text, file=stdout)
+            else:
+                with open(args.profile, 'w') as f:
+                    f.write(text)
+                print("Profile written to '%s'." % args.profile)
+        if cprofiles:
+            import pstats
+            stats = pstats.Stats(cprofiles[0])
+            for profiler in cprofiles[1:]:
+                stats.add(profiler)
+            stats.dump_stats(str(args.cprofile))
+            print("cProfile stats written to '%s'." % args.cprofile)
+        if args.subparser_name == 'json' and (failed or not built):
+            raise SystemExit(1)
         print(r"Move to resource folder ('\minecraft\resourcepacks\') and turn on in options to use.")
     else:
         parser.print_help()
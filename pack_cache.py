@@ -0,0 +1,173 @@
+#! python3
+
+"""A persistent cache of compressed pack members, shared between builds.
+
+Entries are keyed by a hash of the member's content plus the compression
+settings, and hold the raw deflate stream with its crc and size, so a hit
+can be spliced straight into the zip. Least recently used entries are
+evicted once the cache grows past its size limit.
+
+Builds keep transcoded audio and generated or optimized textures in folders
+of their own in the same directory (whether or not members are cached); their
+files count as entries too, so they are sized and evicted along with the rest.
+"""
+
+from pathlib import Path
+from struct import pack, unpack
+from os import environ, replace, utime
+import zlib
+
+# b'MPC1', crc, uncompressed size, then the raw deflate stream
+HEADER_FORMAT = '<4sLQ'
+HEADER_SIZE = 16
+MAGIC = b'MPC1'
+
+# where builds keep files they made, beside the member entries' two-character folders
+DERIVED_FOLDERS = ('transcoded', 'textures', 'optimized')
+
+def defaultCacheDir():
+    '''Where the cache lives unless told otherwise'''
+    if 'LOCALAPPDATA' in environ:
+        return Path(environ['LOCALAPPDATA']) / 'musica-packotron' / 'cache'
+    return Path(environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'musica-packotron'
+
+def touch(path):
+    '''Mark a cached file as just used, for the least recently used order'''
+    try:
+        utime(str(path))
+    except OSError:
+        pass
+
+def hashFile(path, algorithm='sha256'):
+    '''Hex digest of a file's content'''
+    import hashlib
+    digest = hashlib.new(algorithm)
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class MemberCache:
+    '''Compressed member bytes on disk, keyed by content hash and settings.'''
+
+    def __init__(self, directory=None, max_size=2 * 1024**3):
+        self.directory = Path(directory) if directory is not None else defaultCacheDir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.bytes_hit = 0
+        # builds running in threads share one cache
+        from threading import Lock
+        self._lock = Lock()
+
+    def key(self, digest, compress_type, level):
+        '''Cache key for content with a given digest compressed with the given settings'''
+        import hashlib
+        settings = '%s:%s:%s:%s' % (digest, compress_type, level, zlib.ZLIB_RUNTIME_VERSION)
+        return hashlib.sha256(settings.encode('ascii')).hexdigest()
+
+    def _path(self, key):
+        return self.directory / key[:2] / key
+
+    def get(self, key):
+        '''Return (path, crc, file size) for a cached entry, or None.
+        The raw stream starts HEADER_SIZE bytes into the file.'''
+        path = self._path(key)
+        try:
+            with path.open('rb') as f:
+                magic, crc, file_size = unpack(HEADER_FORMAT, f.read(HEADER_SIZE))
+        except (OSError, ValueError):
+            magic = None
+        if magic != MAGIC:
+            with self._lock:
+                self.misses += 1
+            return None
+        # bump it in the LRU order
+        touch(path)
+        with self._lock:
+            self.hits += 1
+            self.bytes_hit += file_size
+        return path, crc, file_size
+
+    def put(self, key, spoolpath, crc, file_size):
+        '''Move a spooled raw stream into the cache. Its first HEADER_SIZE bytes
+        must be left free for the header.'''
+        from shutil import move
+        from tempfile import mkstemp
+        from os import close
+        with open(str(spoolpath), 'r+b') as f:
+            f.write(pack(HEADER_FORMAT, MAGIC, crc, file_size))
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # land it under a temporary name first so readers never see half an entry
+        fd, tmppath = mkstemp(prefix='.tmp-', dir=str(path.parent))
+        close(fd)
+        move(str(spoolpath), tmppath)
+        replace(tmppath, str(path))
+        return path
+
+    def entries(self):
+        '''List (path, size, last used) for every entry, and every file in DERIVED_FOLDERS'''
+        entries = list()
+        if not self.directory.is_dir():
+            return entries
+        paths = list()
+        for sub in self.directory.iterdir():
+            if sub.is_dir() and len(sub.name) == 2:
+                paths.extend(sub.iterdir())
+            elif sub.is_dir() and sub.name in DERIVED_FOLDERS:
+                paths.extend(path for path in sub.glob('**/*') if path.is_file())
+        for path in paths:
+            # half written, by this or another build
+            if path.name.startswith('.tmp-') or '.part' in path.name:
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                # pruned by another build
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def stats(self):
+        '''Counts and sizes, for the cache stats command'''
+        entries = self.entries()
+        return {
+            'directory' : str(self.directory),
+            'entries' : len(entries),
+            'size' : sum(size for path, size, used in entries),
+            'maxSize' : self.max_size,
+            'oldest' : min((used for path, size, used in entries), default=None),
+            'newest' : max((used for path, size, used in entries), default=None),
+            }
+
+    def prune(self, max_size=None):
+        '''Evict least recently used entries until the cache fits in max_size.
+        Returns (entries removed, bytes freed).'''
+        if max_size is None:
+            max_size = self.max_size
+        with self._lock:
+            return self._prune(max_size)
+
+    def _prune(self, max_size):
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for path, size, used in entries)
+        removed = 0
+        freed = 0
+        for path, size, used in entries:
+            if total <= max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            if path.parent.parent.name in DERIVED_FOLDERS:
+                # like a transcode's folder, left empty
+                try:
+                    path.parent.rmdir()
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
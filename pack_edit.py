@@ -0,0 +1,242 @@
+#! python3
+
+"""Add, remove and update records in a finished pack, without its sources.
+
+The records are read back from the pack's record-pack.json, sounds.json and
+en_US.lang, and those are made again once the records have been changed.
+
+Edits are written on after the end of the zip: the new and changed members,
+then a new central directory listing them along with every untouched member
+where it already is. Nothing already in the file is overwritten, so an edit
+takes time for what changed rather than for the size of the pack, and a
+failed one is undone by cutting the file back to its old length. What edits
+replace stays in the file as unused space, until the pack is compacted:
+written out again with every member copied across as it is, still without
+compressing anything again.
+"""
+
+from pathlib import Path
+from time import localtime
+import json
+import re
+import zlib
+import musica_resource_packotron as mt
+import pack_cache
+import pack_zip
+
+SOUNDS_FOLDER = 'assets/musica/sounds/records/'
+TEXTURE_FOLDER = 'assets/musica/textures/items/'
+TEXTURE_MEMBER = TEXTURE_FOLDER + 'record_%s.png'
+TEXT_MEMBERS = ('pack.mcmeta', 'record-pack.json', 'assets/musica/sounds.json',
+                'assets/musica/lang/en_US.lang')
+
+_LANG_LINE = re.compile(r'^item\.(?:musica\.)?record\.([^.]+)\.(desc|lore|name)=(.*)$')
+
+def readRecords(zf):
+    '''Read the records back out of an open pack (a zipfile.ZipFile), as
+    (music, {record name : sound name}, pack_info) for _makeTextContents'''
+    try:
+        record_pack = json.loads(zf.read('record-pack.json').decode('utf-8'))
+        sounds_json = json.loads(zf.read('assets/musica/sounds.json').decode('utf-8'))
+        lang = zf.read('assets/musica/lang/en_US.lang').decode('utf-8')
+    except KeyError as e:
+        raise ValueError("Not a Musica pack, it has no %s" % e)
+    pack_info = dict(record_pack.get('packInfo', dict()))
+    if 'pack.mcmeta' in zf.namelist():
+        pack_info['description'] = json.loads(zf.read('pack.mcmeta').decode('utf-8'))['pack']['description']
+
+    music = dict()
+    for key, record in sorted(record_pack.get('records', dict()).items(),
+                              key=lambda item: int(item[0][len('track'):] or 0)):
+        music[record['recordName']] = {
+            'description' : record['recordName'],
+            'hasLore' : record.get('hasLore', False),
+            'isShiny' : record.get('isShiny', False),
+            'useSpecialName' : record.get('useSpecialName', False),
+            }
+    for line in lang.splitlines():
+        match = _LANG_LINE.match(line)
+        if match and match.group(1) in music:
+            name, kind, value = match.groups()
+            music[name][{'desc' : 'description', 'lore' : 'lore', 'name' : 'specialName'}[kind]] = value
+
+    sounds = dict()
+    for name in music:
+        sound = sounds_json['records.%s' % name]['sounds'][0]['name']
+        sounds[name] = sound[len('records/'):] if sound.startswith('records/') else sound
+    return music, sounds, pack_info
+
+class PackEditor:
+    '''Changes to a pack's records, kept until they're saved'''
+
+    def __init__(self, zippath):
+        from zipfile import ZipFile
+        self.zippath = Path(zippath)
+        with self.zippath.open('rb') as f:
+            with ZipFile(f) as zf:
+                self.music, self.sounds, self.pack_info = readRecords(zf)
+            self.raw = pack_zip.readRawMembers(f)
+        # sound name : where it is in the pack
+        self.sound_members = {Path(arcname).stem : arcname for arcname in self.raw
+                              if arcname.startswith(SOUNDS_FOLDER)}
+        # path in pack : file to put there
+        self.new = dict()
+        self.added = list()
+        self.removed = list()
+        self.updated = list()
+
+    def _record(self, name):
+        if name not in self.music:
+            raise ValueError("No record named '%s' in the pack" % name)
+        return self.music[name]
+
+    def _sameContent(self, arcname, path):
+        '''Whether a member of the pack holds exactly what is in the file at path'''
+        from zipfile import ZipFile
+        with ZipFile(str(self.zippath)) as zf, zf.open(arcname) as member, path.open('rb') as f:
+            while True:
+                chunk = member.read(pack_zip.CHUNK_SIZE)
+                if chunk != f.read(pack_zip.CHUNK_SIZE):
+                    return False
+                if not chunk:
+                    return True
+
+    def _addSound(self, audiopath):
+        '''Put an audio file in the pack, giving its sound name.
+        Audio that's in the pack already is played from where it is; a matching
+        size and CRC-32 only picks out candidates, their contents must match too.'''
+        size = audiopath.stat().st_size
+        same_size = [(sound, self.raw[arcname]) for sound, arcname in self.sound_members.items()
+                     if arcname in self.raw and self.raw[arcname].file_size == size]
+        if same_size:
+            crc = 0
+            with audiopath.open('rb') as f:
+                for chunk in iter(lambda: f.read(pack_zip.CHUNK_SIZE), b''):
+                    crc = zlib.crc32(chunk, crc)
+            for sound, raw in same_size:
+                if raw.crc == crc and self._sameContent(raw.arcname, audiopath):
+                    return sound
+        sound = audiopath.stem
+        if sound.lower() in {other.lower() for other in self.sound_members}:
+            # the name's taken, by different audio most likely, so name it after its content
+            sound = pack_cache.hashFile(audiopath)[:16]
+            if sound in self.sound_members:
+                return sound
+        arcname = SOUNDS_FOLDER + sound + audiopath.suffix
+        self.sound_members[sound] = arcname
+        self.new[arcname] = audiopath
+        return sound
+
+    def _dropSound(self, sound):
+        '''Take a sound out of the pack, unless a record still plays it'''
+        if sound not in self.sounds.values() and sound in self.sound_members:
+            self.new.pop(self.sound_members.pop(sound), None)
+
+    def add(self, audiopath, texturepath, description=None):
+        '''Add a record, returning its name'''
+        audiopath = Path(audiopath).resolve()
+        name = mt.NameAllocator(self.music).allocate(mt._processFilename(audiopath.stem))
+        self.music[name] = {
+            'description' : description if description is not None else audiopath.stem,
+            'hasLore' : False,
+            'isShiny' : False,
+            'useSpecialName' : False,
+            }
+        self.sounds[name] = self._addSound(audiopath)
+        self.new[TEXTURE_MEMBER % name] = Path(texturepath).resolve()
+        self.added.append(name)
+        return name
+
+    def remove(self, name):
+        self._record(name)
+        del self.music[name]
+        self._dropSound(self.sounds.pop(name))
+        self.new.pop(TEXTURE_MEMBER % name, None)
+        self.removed.append(name)
+
+    def update(self, name, audiopath=None, texturepath=None, description=None):
+        '''Give a record new audio, texture or description'''
+        info = self._record(name)
+        if audiopath is not None:
+            self._dropSound(self.sounds.pop(name))
+            self.sounds[name] = self._addSound(Path(audiopath).resolve())
+        if texturepath is not None:
+            self.new[TEXTURE_MEMBER % name] = Path(texturepath).resolve()
+        if description is not None:
+            info['description'] = description
+        self.updated.append(name)
+
+    def _kept(self):
+        '''The members already in the pack that stay as they are'''
+        wanted = {TEXTURE_MEMBER % name for name in self.music}
+        wanted.update(self.sound_members[sound] for sound in set(self.sounds.values()))
+        kept = list()
+        for arcname, raw in self.raw.items():
+            if arcname in TEXT_MEMBERS or arcname in self.new:
+                continue
+            managed = arcname.startswith(SOUNDS_FOLDER) or arcname.startswith(TEXTURE_FOLDER + 'record_')
+            if managed and arcname not in wanted:
+                continue
+            kept.append(raw)
+        return kept
+
+    def _writeNew(self, zw, policy, strip):
+        date_time = localtime()[:6]
+        for arcname, text in mt._makeTextContents(self.music, self.pack_info, self.sounds).items():
+            compress_type, sample = policy.choose(arcname, text)
+            zw.writeStr(arcname, text.encode('utf-8'), compress_type, policy.level, date_time)
+        for arcname, path in self.new.items():
+            compress_type, sample = policy.choose(arcname, path)
+            transform = strip.strip if strip is not None and arcname.lower().endswith('.ogg') else None
+            zw.writeFile(arcname, path, compress_type, policy.level, transform=transform)
+
+    def save(self, policy=None, strip=None, compact=False):
+        '''Write the changes into the pack; new files are stored following policy (a
+        CompressionPolicy) and have their metadata stripped with strip, if given. With
+        compact, the pack is written out again without the space earlier edits left unused.
+        Returns (bytes written, unused bytes left in the pack).'''
+        from os import replace
+        if policy is None:
+            policy = mt.CompressionPolicy()
+        kept = self._kept()
+        with self.zippath.open('r+b') as f:
+            f.seek(0, 2)
+            end = f.tell()
+            if not compact:
+                try:
+                    zw = pack_zip.ZipWriter(f)
+                    for raw in kept:
+                        zw.keepMember(raw)
+                    self._writeNew(zw, policy, strip)
+                    cd_offset = f.tell()
+                    zw.close()
+                except BaseException:
+                    # back to how it was
+                    f.truncate(end)
+                    raise
+                written = f.tell() - end
+            else:
+                partpath = self.zippath.with_name(self.zippath.name + '.part')
+                try:
+                    with partpath.open('wb') as out:
+                        zw = pack_zip.ZipWriter(out)
+                        self._writeNew(zw, policy, strip)
+                        for raw in kept:
+                            f.seek(raw.data_offset)
+                            zw.writeRaw(raw.arcname, f, raw.crc, raw.file_size, raw.compress_type,
+                                        raw.date_time, raw.external_attr, raw.compress_size)
+                        cd_offset = out.tell()
+                        zw.close()
+                        written = out.tell()
+                except BaseException:
+                    if partpath.exists():
+                        partpath.unlink()
+                    raise
+        if compact:
+            replace(str(partpath), str(self.zippath))
+        with self.zippath.open('rb') as f:
+            self.raw = pack_zip.readRawMembers(f)
+        self.new = dict()
+        # everything before the central directory that no member takes up
+        return written, cd_offset - sum(raw.data_offset - raw.header_offset + raw.compress_size
+                                         for raw in self.raw.values())
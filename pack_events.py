@@ -0,0 +1,101 @@
+#! python3
+
+"""Events a pack build sends out as it goes, for progress bars and status reports.
+
+A BuildEvents is handed to the build, and anything subscribed to it is called
+with each event, a dict with its 'type' and what goes with it:
+
+    buildStart  pack
+    stageStart  stage
+    stageEnd    stage, wall, cpu
+    writeStart  members, bytes (everything about to go in the zip)
+    fileStart   name, size
+    fileEnd     name, size, compressedSize, stored, seconds
+    warning     message
+    buildEnd    zip
+
+Listeners are called on the thread doing the build, so they should be quick.
+An empty BuildEvents is false, and the build skips making events altogether
+when there is nobody to hear them.
+
+ProgressMeter is a listener that works out bytes done, throughput and time
+left, and passes that on at most every so often.
+"""
+
+from time import perf_counter
+
+class BuildEvents:
+    '''Listeners for the events of a build'''
+
+    def __init__(self, *listeners):
+        self.listeners = list(listeners)
+
+    def __bool__(self):
+        return bool(self.listeners)
+
+    def subscribe(self, listener):
+        '''Call listener(event) for every event from now on. Returns listener.'''
+        self.listeners.append(listener)
+        return listener
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def emit(self, type, **info):
+        info['type'] = type
+        for listener in self.listeners:
+            listener(info)
+
+class ProgressMeter:
+    '''Turns build events into progress updates, calling
+    callback(status) at most every interval seconds, and always at the end.
+
+    status is a dict of the stage, the file going in, bytes done and total,
+    rate (bytes per second), eta (seconds left, None until known), and whether
+    the build has finished.'''
+
+    def __init__(self, callback, interval=0.1):
+        self.callback = callback
+        self.interval = interval
+        self.stage = None
+        self.file = None
+        self.done = 0
+        self.total = 0
+        self.finished = False
+        self._start = None
+        self._last = None
+
+    def status(self):
+        seconds = perf_counter() - self._start if self._start is not None else 0
+        rate = self.done / seconds if seconds > 0 else 0
+        return {
+            'stage' : self.stage,
+            'file' : self.file,
+            'done' : self.done,
+            'total' : self.total,
+            'rate' : rate,
+            'eta' : (self.total - self.done) / rate if rate > 0 else None,
+            'finished' : self.finished,
+            }
+
+    def __call__(self, event):
+        kind = event['type']
+        if kind == 'stageStart':
+            self.stage = event['stage']
+        elif kind == 'writeStart':
+            self.total = event['bytes']
+            self.done = 0
+            self._start = perf_counter()
+        elif kind == 'fileStart':
+            self.file = event['name']
+        elif kind == 'fileEnd':
+            self.done += event['size']
+        elif kind == 'buildEnd':
+            self.file = None
+            self.finished = True
+        else:
+            return
+        now = perf_counter()
+        if self.finished or self._last is None or now - self._last >= self.interval:
+            self._last = now
+            self.callback(self.status())
@@ -0,0 +1,281 @@
+#! python3
+
+"""Inspect Ogg audio without decoding it, and strip metadata out of it.
+
+Only the identification header on the first page and the granule position
+of the last page are read (through a memory map), which is enough for the
+codec, channels, sample rate, bitrates and the exact duration.
+
+Stripping rewrites the Vorbis comment header, dropping cover art and long
+comments, and re-pages the headers; the audio pages are streamed through
+as they are, only renumbered (with their CRCs fixed) when the number of
+header pages changed.
+"""
+
+from struct import pack, unpack_from, error as StructError
+import mmap
+import zlib
+
+# the biggest an Ogg page can be: header, 255 lacing values, 255 * 255 bytes
+MAX_PAGE_SIZE = 27 + 255 + 255 * 255
+
+# comments holding cover art, which are always stripped
+PICTURE_TAGS = ('METADATA_BLOCK_PICTURE', 'COVERART', 'COVERARTMIME')
+
+# each byte with its bits in reverse order, for pageCrc
+_REVERSED_BITS = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+def _identify(packet):
+    '''Codec info from a stream's first packet'''
+    if packet.startswith(b'\x01vorbis') and len(packet) >= 30:
+        version, channels, rate, bitrate_max, bitrate_nominal, bitrate_min = \
+            unpack_from('<IBIiii', packet, 7)
+        return {'codec' : 'vorbis', 'channels' : channels, 'sampleRate' : rate,
+                'nominalBitrate' : bitrate_nominal if bitrate_nominal > 0 else None}
+    if packet.startswith(b'OpusHead') and len(packet) >= 19:
+        # opus granules always count at 48kHz
+        return {'codec' : 'opus', 'channels' : packet[9], 'sampleRate' : 48000,
+                'nominalBitrate' : None}
+    if packet.startswith(b'\x7fFLAC'):
+        return {'codec' : 'flac', 'channels' : None, 'sampleRate' : None, 'nominalBitrate' : None}
+    if packet.startswith(b'Speex   '):
+        return {'codec' : 'speex', 'channels' : None, 'sampleRate' : None, 'nominalBitrate' : None}
+    return {'codec' : 'unknown', 'channels' : None, 'sampleRate' : None, 'nominalBitrate' : None}
+
+def _lastGranule(data, serial):
+    '''Granule position of the last page of a stream that ends a packet, or None'''
+    end = len(data)
+    start = max(0, end - MAX_PAGE_SIZE)
+    while True:
+        pos = data.rfind(b'OggS', start, end)
+        if pos < 0:
+            if start == 0:
+                return None
+            # the last page could be followed by junk, keep looking further back
+            end = start + 3
+            start = max(0, start - MAX_PAGE_SIZE)
+            continue
+        if pos + 27 <= len(data) and data[pos + 4] == 0:
+            granule, page_serial = unpack_from('<qI', data, pos + 6)
+            if page_serial == serial and granule != -1:
+                return granule
+        end = pos + 3
+
+def inspect(path):
+    '''Look at an audio file, returning a dict of what was found:
+    codec, channels, sampleRate, nominalBitrate, duration (seconds), bitrate
+    (average bits per second over the whole file) and size. codec is None for
+    files that aren't Ogg at all.'''
+    info = {'path' : str(path), 'codec' : None, 'channels' : None, 'sampleRate' : None,
+            'nominalBitrate' : None, 'duration' : None, 'bitrate' : None, 'size' : 0}
+    with open(str(path), 'rb') as f:
+        f.seek(0, 2)
+        info['size'] = size = f.tell()
+        if size < 28:
+            return info
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:4] != b'OggS' or data[4] != 0:
+                return info
+            serial = unpack_from('<I', data, 14)[0]
+            segments = data[26]
+            # the identification header is alone on the first page
+            first = 27 + segments
+            length = sum(data[27:first])
+            info.update(_identify(data[first:first + length]))
+            granule = _lastGranule(data, serial)
+    if granule is not None and info['sampleRate']:
+        info['duration'] = granule / info['sampleRate']
+        if info['duration'] > 0:
+            info['bitrate'] = int(size * 8 / info['duration'])
+    return info
+
+def inspectAll(paths, jobs=4):
+    '''Inspect several files at once, giving {path : info} in the order given.
+    Failures to read a file end up in info['error'].'''
+    from concurrent.futures import ThreadPoolExecutor
+
+    def safe_inspect(path):
+        try:
+            return inspect(path)
+        except (OSError, ValueError) as e:
+            return {'path' : str(path), 'codec' : None, 'error' : str(e)}
+
+    paths = list(paths)
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        return dict(zip(paths, executor.map(safe_inspect, paths)))
+
+def pageCrc(page):
+    '''The CRC of an Ogg page, whose own CRC field must be zeroed.
+
+    Ogg's CRC-32 is zlib's polynomial run the other way round, with no
+    inversions, so it can be had from zlib.crc32 by reversing the bits of
+    each byte going in and of the result coming out.'''
+    crc = zlib.crc32(page.translate(_REVERSED_BITS), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int('{:032b}'.format(crc)[::-1], 2)
+
+def _makePage(header_type, granule, serial, sequence, lacing, body):
+    '''Put an Ogg page together, CRC and all'''
+    page = pack('<4sBBqIII', b'OggS', 0, header_type, granule, serial, sequence, 0) \
+        + bytes([len(lacing)]) + bytes(lacing) + body
+    return page[:22] + pack('<I', pageCrc(page)) + page[26:]
+
+def _readPage(infile):
+    '''The next page of infile as (header, lacing values, body), or None at its end.
+    Anything that isn't a whole page is left unread (trailing tags, say).'''
+    start = infile.tell()
+    header = infile.read(27)
+    if len(header) == 27 and header[:4] == b'OggS':
+        lacing = infile.read(header[26])
+        body = infile.read(sum(lacing))
+        if len(lacing) == header[26] and len(body) == sum(lacing):
+            return header, lacing, body
+    infile.seek(start)
+    return None
+
+def _copyRest(infile, outfile):
+    for chunk in iter(lambda: infile.read(1024 * 1024), b''):
+        outfile.write(chunk)
+
+def _pagePackets(packets, serial, sequence):
+    '''Lay whole packets out on as few pages as will hold them'''
+    segments = list()
+    for packet in packets:
+        for start in range(0, len(packet) - len(packet) % 255, 255):
+            segments.append((255, packet[start:start + 255]))
+        segments.append((len(packet) % 255, packet[len(packet) - len(packet) % 255:]))
+    pages = list()
+    continued = False
+    for start in range(0, len(segments), 255):
+        page = segments[start:start + 255]
+        pages.append(_makePage(1 if continued else 0, 0, serial, sequence + len(pages),
+                               [size for size, data in page], b''.join(data for size, data in page)))
+        # a page ending in a full segment leaves its packet to the next one
+        continued = page[-1][0] == 255
+    return pages
+
+def stripComment(packet, max_comment=256):
+    '''A Vorbis comment packet without cover art, or comments longer than
+    max_comment bytes. Returns None when there was nothing to strip.'''
+    if not packet.startswith(b'\x03vorbis'):
+        return None
+    vendor_length = unpack_from('<I', packet, 7)[0]
+    pos = 11 + vendor_length
+    count = unpack_from('<I', packet, pos)[0]
+    pos += 4
+    kept = list()
+    for i in range(count):
+        length = unpack_from('<I', packet, pos)[0]
+        comment = packet[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        tag = comment.split(b'=', 1)[0].decode('ascii', 'replace').upper()
+        if tag not in PICTURE_TAGS and length <= max_comment:
+            kept.append(comment)
+    if len(kept) == count:
+        return None
+    return packet[:11 + vendor_length] + pack('<I', len(kept)) \
+        + b''.join(pack('<I', len(comment)) + comment for comment in kept) + b'\x01'
+
+def _readHeaders(infile):
+    '''Read the first page and the pages holding the comment and setup packets of an
+    Ogg Vorbis stream, as (first page, serial, [pages], [packets], leftover packet),
+    or None if it isn't a plain Vorbis stream.'''
+    first = _readPage(infile)
+    if first is None or first[1] != bytes([len(first[2])]) or not first[2].startswith(b'\x01vorbis'):
+        return None
+    serial = unpack_from('<I', first[0], 14)[0]
+    # collect the comment and setup packets, which follow on pages of their own
+    pages = list()
+    packets = list()
+    packet = b''
+    while len(packets) < 2:
+        page = _readPage(infile)
+        if page is None or unpack_from('<I', page[0], 14)[0] != serial or not page[1]:
+            break
+        pages.append(page)
+        pos = 0
+        for size in page[1]:
+            packet += page[2][pos:pos + size]
+            pos += size
+            if size < 255:
+                packets.append(packet)
+                packet = b''
+    return first, serial, pages, packets, packet
+
+def commentProblem(path):
+    '''Why the Vorbis comment header of the file at path can't be stripped
+    (it is cut short, say), or None if it can be or there isn't one.'''
+    with open(str(path), 'rb') as infile:
+        headers = _readHeaders(infile)
+    if headers is None or len(headers[3]) < 1:
+        return None
+    try:
+        stripComment(headers[3][0])
+    except (StructError, IndexError):
+        return 'its comment header is cut short or malformed'
+    return None
+
+def stripStream(infile, outfile, max_comment=256):
+    '''Copy an Ogg Vorbis stream from seekable infile to outfile without its cover
+    art and long comments. Anything that isn't a plain Vorbis stream, has nothing
+    to strip, or has a comment header that can't be read, is copied as it is.'''
+    start = infile.tell()
+    headers = _readHeaders(infile)
+    if headers is None:
+        infile.seek(start)
+        _copyRest(infile, outfile)
+        return
+    first, serial, pages, packets, packet = headers
+    comment = None
+    # the setup packet has to end its page, audio starts on a fresh one
+    if len(packets) == 2 and not packet and pages[-1][1][-1] < 255:
+        try:
+            comment = stripComment(packets[0], max_comment)
+        except (StructError, IndexError):
+            # commentProblem() tells the build about it
+            comment = None
+    if comment is None:
+        infile.seek(start)
+        _copyRest(infile, outfile)
+        return
+    outfile.write(b''.join(first))
+    headers = _pagePackets([comment, packets[1]], serial, 1)
+    for page in headers:
+        outfile.write(page)
+    shift = len(headers) - len(pages)
+    # the rest of the stream's pages only need renumbering if the header took fewer pages
+    while shift:
+        page = _readPage(infile)
+        if page is None:
+            break
+        header, lacing, body = page
+        ours = unpack_from('<I', header, 14)[0] == serial
+        if ours:
+            sequence = unpack_from('<I', header, 18)[0] + shift
+            header = header[:18] + pack('<II', sequence, 0) + header[26:]
+            header = header[:22] + pack('<I', pageCrc(header + lacing + body)) + header[26:]
+        outfile.write(header + lacing + body)
+        if ours and header[5] & 4:
+            # end of the stream, anything chained after it is left as it is
+            break
+    _copyRest(infile, outfile)
+
+class StripSettings:
+    '''What to strip from Ogg files on their way into a pack.
+
+    Cover art always goes; so do comments longer than max_comment bytes.'''
+
+    def __init__(self, max_comment=256):
+        self.max_comment = max_comment
+
+    @classmethod
+    def fromInfo(cls, info):
+        '''Make settings from a "stripMetadata" dict, as found in a JSON file'''
+        return cls(max_comment=info.get('maxComment', 256))
+
+    def key(self):
+        '''Tells stripped content apart from the original in cache keys'''
+        return 'strip:%s' % self.max_comment
+
+    def strip(self, infile, outfile):
+        '''Copy infile to outfile, stripped'''
+        stripStream(infile, outfile, self.max_comment)
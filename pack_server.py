@@ -0,0 +1,321 @@
+#! python3
+
+"""A local HTTP service that builds packs, for a website to hand track lists to.
+
+    POST /jobs              a zip of spec.json (as for the json command) and the files
+                            it names; answers 202 with the job, or 200 with the job
+                            already building the same thing
+    GET  /jobs/<id>         the job's status (queued, running, done or failed) and progress
+    GET  /jobs/<id>/pack    the finished .rpack.zip
+    GET  /                  how busy the service is
+
+Builds run on a fixed number of worker threads, fed from a queue of limited
+depth; once it is full, new jobs are turned away with 503 and a Retry-After
+header until there is room. Uploads with the same spec and files as a job
+that is queued, running or done get that job rather than a build of their own.
+
+Paths in an uploaded spec must stay inside the upload, and its "transcode"
+options are ignored, since they can name a program to run; the service's own
+options (from the command line) apply to every build.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from queue import Queue, Full
+from threading import Lock, Thread
+from time import time
+import json
+import musica_resource_packotron as mt
+import pack_events
+import pack_zip
+
+SPEC_NAME = 'spec.json'
+PACK_NAME = 'pack.rpack.zip'
+
+class QueueFull(Exception):
+    '''No room for another job right now'''
+
+class Job:
+    '''A pack to build, and how it is getting on'''
+
+    def __init__(self, id, key, folder, spec):
+        self.id = id
+        self.key = key
+        self.folder = folder
+        self.spec = spec
+        self.status = 'queued'
+        self.progress = None
+        self.error = None
+        self.result = None
+        self.created = time()
+        self.finished = None
+
+    def setProgress(self, status):
+        self.progress = status
+
+    def info(self):
+        '''The job as a dict ready for JSON'''
+        info = {'id' : self.id, 'status' : self.status, 'created' : self.created,
+                'finished' : self.finished}
+        if self.progress is not None:
+            info['progress'] = {key : self.progress[key] for key in ('stage', 'done', 'total', 'eta')}
+        if self.error is not None:
+            info['error'] = self.error
+        if self.result is not None:
+            info.update(size=self.result.size, sha256=self.result.sha256, seconds=self.result.seconds,
+                        warnings=self.result.warnings, pack='/jobs/%s/pack' % self.id)
+        return info
+
+def _checkInside(path, folder):
+    if path is not None and folder not in Path(path).resolve().parents:
+        raise ValueError("'%s' is outside the upload" % path)
+
+def unpackUpload(body, folder, max_size):
+    '''Unzip an upload into folder, returning (spec, key), where key is the same
+    for any upload of the same spec and files. Raises ValueError for bad uploads.'''
+    from io import BytesIO
+    from zipfile import ZipFile, BadZipFile
+    import hashlib
+    try:
+        zf = ZipFile(BytesIO(body))
+    except BadZipFile:
+        raise ValueError('The upload is not a zip file')
+    folder = folder.resolve()
+    files = dict()
+    total = 0
+    with zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            path = (folder / info.filename).resolve()
+            _checkInside(path, folder)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            with zf.open(info) as src, path.open('wb') as dst:
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    # sizes in the zip can't be trusted, count what comes out
+                    total += len(chunk)
+                    if total > max_size:
+                        raise ValueError('The upload unpacks to more than %s' % mt._formatBytes(max_size))
+                    digest.update(chunk)
+                    dst.write(chunk)
+            files[path.relative_to(folder).as_posix()] = digest.hexdigest()
+    if SPEC_NAME not in files:
+        raise ValueError('The upload has no %s' % SPEC_NAME)
+    try:
+        with (folder / SPEC_NAME).open('r') as f:
+            spec = json.load(f)
+        spec.pop('transcode', None)
+        spec.pop('outputdir', None)
+        music, pack_info, outputdir, options = mt._parseSpec(spec, folder)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError('Bad %s: %s' % (SPEC_NAME, e))
+    for info in music.values():
+        _checkInside(info['audioPath'], folder)
+        _checkInside(info['texturePath'], folder)
+    _checkInside(pack_info.get('thumbnailPath'), folder)
+    _checkInside(options.get('textures', dict()).get('base'), folder)
+    del files[SPEC_NAME]
+    key = hashlib.sha256(json.dumps([spec, sorted(files.items())], sort_keys=True).encode('utf-8'))
+    return spec, key.hexdigest()
+
+class PackServer(ThreadingHTTPServer):
+    '''The service: an HTTP server with a queue of jobs and the workers building them.
+    options are laid over every spec's own, as on the command line; jobs, cache
+    and events are as for build_pack. Finished jobs past the newest keep are removed.'''
+
+    daemon_threads = True
+
+    def __init__(self, address, workdir=None, workers=2, queue_size=8, options=None, jobs=1,
+                 cache=None, max_upload=256 * 1024**2, keep=100):
+        super().__init__(address, PackRequestHandler)
+        from tempfile import mkdtemp
+        self.own_workdir = workdir is None
+        self.workdir = Path(workdir if workdir is not None else mkdtemp(prefix='packotron-serve-')).resolve()
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        self.options = options or dict()
+        self.jobs = jobs
+        self.cache = cache
+        self.max_upload = max_upload
+        self.keep = keep
+        self.queue = Queue(queue_size)
+        self.lock = Lock()
+        # by id, oldest first
+        self.all_jobs = dict()
+        self.by_key = dict()
+        self.running = 0
+        self.pool = None
+        if jobs > 1:
+            # one process pool shared by every build, as for a batch of JSON files
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(jobs)
+        self.workers = [Thread(target=self._work, daemon=True) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, body):
+        '''Queue a build of an upload, returning (job, whether it's new).
+        Raises ValueError for a bad upload, QueueFull when there's no room.'''
+        from secrets import token_hex
+        from shutil import rmtree
+        id = token_hex(8)
+        folder = self.workdir / id
+        folder.mkdir()
+        try:
+            spec, key = unpackUpload(body, folder, self.max_upload * 4)
+            with self.lock:
+                job = self.by_key.get(key)
+                if job is not None and job.status != 'failed':
+                    rmtree(str(folder), ignore_errors=True)
+                    return job, False
+                job = Job(id, key, folder, spec)
+                self.queue.put_nowait(job)
+                self.all_jobs[id] = job
+                self.by_key[key] = job
+            return job, True
+        except Full:
+            rmtree(str(folder), ignore_errors=True)
+            raise QueueFull('%s job(s) are already waiting' % self.queue.maxsize)
+        except BaseException:
+            rmtree(str(folder), ignore_errors=True)
+            raise
+
+    def job(self, id):
+        with self.lock:
+            return self.all_jobs.get(id)
+
+    def status(self):
+        '''How busy the service is'''
+        with self.lock:
+            return {'workers' : len(self.workers), 'running' : self.running,
+                    'queued' : self.queue.qsize(), 'queueSize' : self.queue.maxsize,
+                    'jobs' : len(self.all_jobs)}
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                job.status = 'running'
+                self.running += 1
+            try:
+                result = mt.build_pack(job.spec, job.folder / PACK_NAME, self.options, base=job.folder,
+                                       jobs=self.jobs, cache=self.cache, pool=self.pool,
+                                       events=pack_events.BuildEvents(pack_events.ProgressMeter(job.setProgress)))
+            except Exception as e:
+                job.error = str(e)
+                status = 'failed'
+            else:
+                job.result = result
+                status = 'done'
+            with self.lock:
+                job.status = status
+                job.finished = time()
+                self.running -= 1
+                self._forgetOldJobs()
+
+    def _forgetOldJobs(self):
+        from shutil import rmtree
+        finished = [job for job in self.all_jobs.values() if job.finished is not None]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.all_jobs[job.id]
+            if self.by_key.get(job.key) is job:
+                del self.by_key[job.key]
+            rmtree(str(job.folder), ignore_errors=True)
+
+    def server_close(self):
+        '''Stop the workers (after what they're building) and clean up'''
+        super().server_close()
+        from shutil import rmtree
+        # drop what's still waiting, then tell each worker to stop
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.own_workdir:
+            rmtree(str(self.workdir), ignore_errors=True)
+
+class PackRequestHandler(BaseHTTPRequestHandler):
+    '''Answers requests to a PackServer'''
+
+    server_version = 'MusicaPackotron'
+
+    def _sendJson(self, code, info, headers=()):
+        body = json.dumps(info, indent=4).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sendError(self, code, message, headers=()):
+        self._sendJson(code, {'error' : message}, headers)
+
+    def do_GET(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if not parts:
+            return self._sendJson(200, self.server.status())
+        if parts[0] != 'jobs' or len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] != 'pack'):
+            return self._sendError(404, 'Not found')
+        job = self.server.job(parts[1])
+        if job is None:
+            return self._sendError(404, 'No such job')
+        if len(parts) == 2:
+            return self._sendJson(200, job.info())
+        if job.status != 'done':
+            return self._sendError(409, 'The job is %s' % job.status)
+        path = job.result.path
+        name = Path(job.spec.get('pack_info', dict()).get('packName') or 'pack').name + '.rpack.zip'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Length', str(path.stat().st_size))
+        self.send_header('Content-Disposition', 'attachment; filename="%s"' % name.replace('"', ''))
+        self.end_headers()
+        with path.open('rb') as f:
+            pack_zip.copyStream(f, self.wfile)
+
+    def do_POST(self):
+        if self.path.split('?')[0].rstrip('/') != '/jobs':
+            return self._sendError(404, 'Not found')
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            return self._sendError(411, 'Content-Length needed')
+        # int() would take signs, spaces and underscores too
+        if not length.isascii() or not length.isdigit():
+            self.close_connection = True
+            return self._sendError(400, 'Bad Content-Length %r' % length)
+        length = int(length)
+        if length > self.server.max_upload:
+            self.close_connection = True
+            return self._sendError(413, 'Uploads are limited to %s' % mt._formatBytes(self.server.max_upload))
+        body = self.rfile.read(length)
+        if len(body) < length:
+            self.close_connection = True
+            return self._sendError(400, 'The upload was cut short')
+        try:
+            job, new = self.server.submit(body)
+        except ValueError as e:
+            return self._sendError(400, str(e))
+        except QueueFull as e:
+            return self._sendError(503, str(e), [('Retry-After', '5')])
+        self._sendJson(202 if new else 200, job.info(), [('Location', '/jobs/%s' % job.id)])
+
+def serve(host='127.0.0.1', port=8000, **settings):
+    '''Run the service until interrupted; settings are as for PackServer'''
+    server = PackServer((host, port), **settings)
+    print('Serving on http://%s:%s/ with %s worker(s), building in %s' % (
+        server.server_address[0], server.server_address[1], len(server.workers), server.workdir))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,340 @@
+#! python3
+
+"""Generate and optimize record textures.
+
+Generating gives every track its own variant of one base image, hue-shifted
+by an amount taken from a hash of the track's name (or picked from a palette
+by that hash). All variants are made together with NumPy array operations,
+and the results are cached by base image hash plus parameters.
+
+Optimizing scales textures down to item texture size, drops ancillary PNG
+chunks and re-encodes them losslessly with whichever filter compresses best.
+
+Needs NumPy and Pillow, which are only imported when they're used.
+"""
+
+from pathlib import Path
+
+# no more than this many pixels are worked on at once, which bounds memory
+# when the base image is big
+BATCH_PIXELS = 1 << 22
+
+def _requireImaging():
+    '''Import numpy and Pillow, explaining what's missing if they aren't there'''
+    try:
+        import numpy
+        from PIL import Image
+    except ImportError as e:
+        raise RuntimeError('Generating textures needs NumPy and Pillow installed (%s).' % e)
+    return numpy, Image
+
+def nameFraction(name):
+    '''A stable number in [0, 1) for a track name'''
+    import hashlib
+    return int(hashlib.sha1(name.encode('utf-8')).hexdigest()[:8], 16) / float(1 << 32)
+
+def rgbToHsv(np, rgb):
+    '''Float rgb array (..., 3) in [0, 1] to hue, saturation, value arrays'''
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    delta = maxc - minc
+    safe = np.where(delta > 0, delta, 1)
+    s = np.where(maxc > 0, delta / np.where(maxc > 0, maxc, 1), 0)
+    rc = (maxc - r) / safe
+    gc = (maxc - g) / safe
+    bc = (maxc - b) / safe
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(delta > 0, (h / 6.0) % 1.0, 0)
+    return h, s, maxc
+
+def hsvToRgb(np, h, s, v):
+    '''Hue, saturation, value arrays back to a float rgb array (..., 3)'''
+    i = np.floor(h * 6.0)
+    f = h * 6.0 - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i.astype(np.int8) % 6
+    conditions = [i == k for k in range(6)]
+    r = np.select(conditions, [v, q, p, p, t, v])
+    g = np.select(conditions, [t, v, v, q, p, p])
+    b = np.select(conditions, [p, p, t, v, v, q])
+    return np.stack([r, g, b], axis=-1)
+
+class TextureSettings:
+    '''How record textures get generated.
+
+    mode 'hue' rotates the base texture's hue by a fraction taken from the
+    track name; 'palette' rotates it to one of the palette's hues (degrees)
+    instead, so variants come from a fixed set of colours.'''
+
+    default_palette = (0, 45, 90, 135, 180, 225, 270, 315)
+
+    def __init__(self, base, mode='hue', palette=None):
+        if mode not in ('hue', 'palette'):
+            raise ValueError("Unknown texture mode '%s', use 'hue' or 'palette'" % mode)
+        self.base = Path(base)
+        self.mode = mode
+        self.palette = tuple(palette or self.default_palette)
+
+    @classmethod
+    def fromInfo(cls, info, base_dir=None):
+        '''Make settings from a "textures" dict, as found in a JSON file'''
+        if info.get('base') is None:
+            raise ValueError('Generating textures needs a base texture.')
+        base = Path(info['base'])
+        if base_dir is not None:
+            base = Path(base_dir) / base
+        return cls(base.resolve(), info.get('mode', 'hue'), info.get('palette'))
+
+    def shift(self, name):
+        '''The hue rotation (a fraction of a turn) for a track'''
+        fraction = nameFraction(name)
+        if self.mode == 'palette':
+            return self.palette[int(fraction * len(self.palette))] / 360.0
+        return fraction
+
+def generateTextures(settings, names, cachedir):
+    '''Make a texture for each of names from settings.base, returning {name : png path}.
+    Textures already in cachedir are reused; the rest are made in batches.'''
+    from pack_cache import hashFile, touch
+    from os import replace
+    import hashlib
+    cachedir = Path(cachedir)
+    base_digest = hashFile(settings.base)
+    shifts = {name : settings.shift(name) for name in names}
+
+    def path_for(shift):
+        key = hashlib.sha256(('%s:%s:%.6f' % (base_digest, settings.mode, shift)).encode('ascii'))
+        return cachedir / key.hexdigest()[:2] / (key.hexdigest() + '.png')
+
+    paths = {name : path_for(shift) for name, shift in shifts.items()}
+    todo = sorted({shift for name, shift in shifts.items() if not paths[name].is_file()})
+    for path in set(paths.values()):
+        if path.is_file():
+            touch(path)
+    if todo:
+        np, Image = _requireImaging()
+        with Image.open(str(settings.base)) as image:
+            rgba = np.asarray(image.convert('RGBA'), dtype=np.float32) / 255.0
+        h, s, v = rgbToHsv(np, rgba[..., :3])
+        alpha = np.round(rgba[..., 3] * 255).astype(np.uint8)
+        batch = max(1, BATCH_PIXELS // (h.size or 1))
+        for start in range(0, len(todo), batch):
+            chunk = todo[start:start + batch]
+            # every variant in the chunk at once: (n, height, width)
+            offsets = np.asarray(chunk, dtype=np.float32)[:, np.newaxis, np.newaxis]
+            hues = (h[np.newaxis] + offsets) % 1.0
+            rgb = hsvToRgb(np, hues, np.broadcast_to(s, hues.shape), np.broadcast_to(v, hues.shape))
+            rgb = np.round(rgb * 255).astype(np.uint8)
+            for shift, pixels in zip(chunk, rgb):
+                out = np.dstack([pixels, alpha])
+                path = path_for(shift)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                partpath = path.with_name(path.name + '.part')
+                Image.fromarray(out, 'RGBA').save(str(partpath), format='PNG', optimize=True)
+                replace(str(partpath), str(path))
+    return paths
+
+# PNG chunks a texture needs; everything else (text, EXIF, colour profiles,
+# timestamps...) is ancillary and gets dropped
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+KEPT_CHUNKS = (b'IHDR', b'PLTE', b'tRNS', b'IDAT', b'IEND')
+
+def pngChunks(data):
+    '''Split PNG bytes into (type, body) chunks'''
+    from struct import unpack_from
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError('Not a PNG file')
+    pos = len(PNG_SIGNATURE)
+    chunks = list()
+    while pos + 8 <= len(data):
+        length, kind = unpack_from('>I4s', data, pos)
+        chunks.append((kind, data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+        if kind == b'IEND':
+            break
+    return chunks
+
+def pngSize(path):
+    '''A PNG file's (width, height), from its header alone'''
+    from struct import unpack_from
+    with Path(path).open('rb') as f:
+        data = f.read(len(PNG_SIGNATURE) + 16)
+    if not data.startswith(PNG_SIGNATURE) or data[len(PNG_SIGNATURE) + 4:len(PNG_SIGNATURE) + 8] != b'IHDR':
+        raise ValueError("'%s' is not a PNG file" % path)
+    return unpack_from('>II', data, len(PNG_SIGNATURE) + 8)
+
+def makePng(chunks):
+    '''Join (type, body) chunks into PNG bytes'''
+    from struct import pack
+    import zlib
+    return PNG_SIGNATURE + b''.join(
+        pack('>I', len(body)) + kind + body + pack('>I', zlib.crc32(kind + body))
+        for kind, body in chunks)
+
+def stripPng(data):
+    '''The PNG with only the chunks that matter for a texture'''
+    return makePng([chunk for chunk in pngChunks(data) if chunk[0] in KEPT_CHUNKS])
+
+def filterRows(np, rows, bpp):
+    '''Every PNG filter applied to a (height, stride) uint8 image, plus a per-row
+    adaptive pick. Yields filtered data (with the filter byte leading each row).'''
+    height, stride = rows.shape
+    x = rows.astype(np.int16)
+    up = np.zeros_like(x)
+    up[1:] = x[:-1]
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    upleft = np.zeros_like(x)
+    upleft[1:, bpp:] = x[:-1, :-bpp]
+    # paeth predictor, for all pixels at once
+    p = left + up - upleft
+    pa = np.abs(p - left)
+    pb = np.abs(p - up)
+    pc = np.abs(p - upleft)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+    filtered = np.stack([
+        x,
+        x - left,
+        x - up,
+        x - (left + up) // 2,
+        x - paeth,
+        ]).astype(np.uint8)
+    for kind in range(5):
+        yield np.hstack([np.full((height, 1), kind, np.uint8), filtered[kind]]).tobytes()
+    # adaptive: the usual minimum sum of absolute differences heuristic, row by row
+    cost = np.abs(filtered.astype(np.int8).astype(np.int16)).sum(axis=2)
+    best = cost.argmin(axis=0)
+    chosen = filtered[best, np.arange(height)]
+    yield np.hstack([best.astype(np.uint8)[:, np.newaxis], chosen]).tobytes()
+
+def encodePng(np, image, level=9):
+    '''Losslessly encode a Pillow image as small as can be managed: as a palette
+    image when it has 256 colours or fewer, trying every filter strategy.'''
+    from struct import pack
+    import zlib
+    rgba = np.asarray(image.convert('RGBA'))
+    height, width = rgba.shape[:2]
+    chunks = list()
+    colours = image.convert('RGBA').getcolors(256)
+    if colours is not None:
+        # palette image: indexes into the colours, most used first
+        palette = [colour for count, colour in sorted(colours, key=lambda c: -c[0])]
+        flat = rgba.reshape(-1, 4)
+        packed = flat.astype(np.uint32) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], np.uint32)
+        keys = np.array([(r << 24) | (g << 16) | (b << 8) | a for r, g, b, a in palette], np.uint32)
+        order = np.argsort(keys)
+        indexes = order[np.searchsorted(keys[order], packed)]
+        rows = indexes.astype(np.uint8).reshape(height, width)
+        bpp = 1
+        header = pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)
+        chunks.append((b'PLTE', bytes(c for colour in palette for c in colour[:3])))
+        alphas = bytes(colour[3] for colour in palette).rstrip(b'\xff')
+        if alphas:
+            chunks.append((b'tRNS', alphas))
+    elif (rgba[..., 3] == 255).all():
+        rows = rgba[..., :3].reshape(height, width * 3)
+        bpp = 3
+        header = pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    else:
+        rows = rgba.reshape(height, width * 4)
+        bpp = 4
+        header = pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    idat = min((zlib.compress(data, level) for data in filterRows(np, rows, bpp)), key=len)
+    return makePng([(b'IHDR', header)] + chunks + [(b'IDAT', idat), (b'IEND', b'')])
+
+class OptimizeSettings:
+    '''How textures get optimized: record textures are scaled down to fit in
+    size x size pixels and the pack thumbnail to thumbnail_size; nothing is
+    ever scaled up.'''
+
+    def __init__(self, size=16, thumbnail_size=128, level=9):
+        self.size = size
+        self.thumbnail_size = thumbnail_size
+        self.level = level
+
+    @classmethod
+    def fromInfo(cls, info):
+        '''Make settings from an "optimizeTextures" dict, as found in a JSON file'''
+        return cls(size=info.get('size', 16), thumbnail_size=info.get('thumbnailSize', 128),
+                   level=info.get('level', 9))
+
+    def key(self, digest, size):
+        '''Cache key for a source with the given digest, fitted to size'''
+        import hashlib
+        return hashlib.sha256(('%s:%s:%s:1' % (digest, size, self.level)).encode('ascii')).hexdigest()
+
+def dimensionWarning(path, width, height, original=None):
+    '''What's wrong with a texture's dimensions, or None; given the (width, height)
+    it had before it was scaled as original, the warning says so'''
+    scaled = ' (scaled down from %sx%s)' % original if original is not None and original != (width, height) else ''
+    if width != height and height % width != 0:
+        return "'%s' is %sx%s%s, item textures should be square." % (path, width, height, scaled)
+    if width & (width - 1):
+        return "'%s' is %sx%s%s, item textures should be a power of 2 wide." % (path, width, height, scaled)
+    return None
+
+def optimizeTexture(path, outpath, size, level=9):
+    '''Scale a texture down to fit size x size, drop its ancillary chunks and
+    re-encode it, keeping whichever of that and the stripped original is smaller.
+    Returns the original (width, height).'''
+    from os import replace
+    from io import BytesIO
+    np, Image = _requireImaging()
+    data = Path(path).read_bytes()
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+    width, height = image.size
+    if not width or not height:
+        raise ValueError("'%s' has no pixels" % path)
+    scaled = False
+    if max(width, height) > size and height % width == 0 and height > width:
+        # animated strip of square frames, scale the frames down
+        frames = height // width
+        if width > size:
+            image = image.convert('RGBA').resize((size, size * frames), Image.LANCZOS)
+            scaled = True
+    elif max(width, height) > size:
+        ratio = size / float(max(width, height))
+        image = image.convert('RGBA').resize((max(1, round(width * ratio)), max(1, round(height * ratio))),
+                                             Image.LANCZOS)
+        scaled = True
+    candidates = [encodePng(np, image, level)]
+    if not scaled and data.startswith(PNG_SIGNATURE):
+        candidates.append(stripPng(data))
+    best = min(candidates, key=len)
+    outpath = Path(outpath)
+    outpath.parent.mkdir(parents=True, exist_ok=True)
+    partpath = outpath.with_name(outpath.name + '.part')
+    partpath.write_bytes(best)
+    replace(str(partpath), str(outpath))
+    return width, height
+
+def optimizeTextures(paths, settings, cachedir, jobs=1):
+    '''Optimize textures several at once; paths are (source, size to fit) pairs.
+    Returns {(source, size) : (optimized path, original (width, height))}.
+    Results are cached by content hash, so unchanged textures are only done once.
+
+    Threads are enough here, zlib, NumPy and Pillow all let go of the GIL.'''
+    from concurrent.futures import ThreadPoolExecutor
+    from pack_cache import hashFile, touch
+    cachedir = Path(cachedir)
+
+    def optimize(item):
+        source, size = item
+        key = settings.key(hashFile(source), size)
+        outpath = cachedir / key[:2] / (key + '.png')
+        # the original's dimensions, kept for the warnings
+        sizepath = outpath.with_suffix('.size')
+        if outpath.is_file() and sizepath.is_file():
+            touch(outpath)
+            touch(sizepath)
+            return item, (outpath, tuple(map(int, sizepath.read_text().split())))
+        dimensions = optimizeTexture(source, outpath, size, settings.level)
+        sizepath.write_text('%s %s' % dimensions)
+        return item, (outpath, dimensions)
+
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        return dict(executor.map(optimize, list(dict.fromkeys(paths))))
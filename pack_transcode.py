@@ -0,0 +1,127 @@
+#! python3
+
+"""Re-encode audio to Ogg Vorbis at a target quality or bitrate.
+
+Non-Ogg inputs (.wav, .flac, .mp3, ...) and Oggs above a bitrate limit are
+re-encoded with a locally installed ffmpeg or oggenc. Results are kept in a
+cache folder keyed by a hash of the source plus the settings, so each file
+is only ever encoded once.
+"""
+
+from pathlib import Path
+import pack_ogg
+
+ENCODERS = ('ffmpeg', 'oggenc')
+# goes in every cache key; bump it whenever command() changes what gets encoded
+COMMAND_VERSION = 2
+
+class TranscodeSettings:
+    '''What to re-encode, and how.
+
+    quality is a Vorbis quality (-1 to 10); bitrate (kbps) targets an average
+    bitrate instead. Oggs above max_bitrate (kbps) are re-encoded too.'''
+
+    def __init__(self, quality=4, bitrate=None, max_bitrate=192, encoder=None):
+        self.quality = quality
+        self.bitrate = bitrate
+        self.max_bitrate = max_bitrate
+        self.encoder = encoder
+
+    @classmethod
+    def fromInfo(cls, info):
+        '''Make settings from a "transcode" dict, as found in a JSON file'''
+        return cls(quality=info.get('quality', 4),
+                   bitrate=info.get('bitrate'),
+                   max_bitrate=info.get('maxBitrate', 192),
+                   encoder=info.get('encoder'))
+
+    def findEncoder(self):
+        '''Path of the encoder to use'''
+        from shutil import which
+        for name in ([self.encoder] if self.encoder else ENCODERS):
+            found = which(name)
+            if found is not None:
+                return found
+        raise RuntimeError('Transcoding needs %s installed and on the PATH.'
+                           % (self.encoder or ' or '.join(ENCODERS)))
+
+    def needsTranscode(self, path):
+        '''Whether a file gets re-encoded'''
+        path = Path(path)
+        if path.suffix.lower() != '.ogg':
+            return True
+        info = pack_ogg.inspect(path)
+        if info['codec'] != 'vorbis':
+            # not really Ogg, or not Vorbis (like Opus), which Minecraft can't play
+            return True
+        bitrate = info['nominalBitrate'] or info['bitrate'] or 0
+        return self.max_bitrate is not None and bitrate > self.max_bitrate * 1000
+
+    def key(self, digest, encoder=None):
+        '''Cache key for a source with the given digest, encoded with encoder
+        (the path findEncoder gave, or the one asked for if not given)'''
+        import hashlib
+        encoder = encoder or self.encoder
+        settings = 'v%s:%s:%g:%s:%s' % (COMMAND_VERSION, digest, self.quality, self.bitrate,
+                                        Path(encoder).stem.lower() if encoder else '')
+        return hashlib.sha256(settings.encode('utf-8')).hexdigest()
+
+    def command(self, encoder, source, outpath):
+        '''The encoder command line. Both are kept from picking a random Ogg stream
+        serial number (or stamping their version in), so the same source always
+        encodes to the same bytes.'''
+        if Path(encoder).stem.lower() == 'oggenc':
+            rate = ['-b', str(self.bitrate)] if self.bitrate else ['-q', str(self.quality)]
+            return [encoder, '--quiet', '--serial', '1'] + rate + ['-o', str(outpath), str(source)]
+        rate = ['-b:a', '%sk' % self.bitrate] if self.bitrate else ['-q:a', str(self.quality)]
+        return [encoder, '-nostdin', '-v', 'error', '-y', '-i', str(source), '-vn',
+                '-map_metadata', '-1', '-c:a', 'libvorbis'] + rate + [
+                '-fflags', '+bitexact', '-flags:a', '+bitexact', '-f', 'ogg', str(outpath)]
+
+def transcodeFile(source, outpath, settings, encoder):
+    '''Encode source into outpath, landing it under its final name only once it's done.'''
+    from subprocess import run, PIPE
+    from os import replace
+    outpath = Path(outpath)
+    outpath.parent.mkdir(parents=True, exist_ok=True)
+    partpath = outpath.with_name(outpath.name + '.part.ogg')
+    result = run(settings.command(encoder, source, partpath), stdout=PIPE, stderr=PIPE)
+    if result.returncode != 0 or not partpath.is_file():
+        if partpath.exists():
+            partpath.unlink()
+        raise RuntimeError("Couldn't transcode '%s': %s" % (
+            source, result.stderr.decode('utf-8', 'replace').strip()))
+    replace(str(partpath), str(outpath))
+    return outpath
+
+def transcodeAll(paths, settings, cachedir, jobs=1):
+    '''Re-encode whichever of paths need it, several at once.
+
+    Each encoder runs in its own process, so a thread per job is enough to keep
+    them all busy. Returns {source path : transcoded path} for the files that
+    needed it; each lands in cachedir/<key>/<source stem>.ogg, so its name in
+    the pack stays the same.'''
+    from concurrent.futures import ThreadPoolExecutor
+    from shutil import copyfile
+    from pack_cache import hashFile, touch
+    cachedir = Path(cachedir)
+    todo = [Path(path) for path in dict.fromkeys(paths) if settings.needsTranscode(path)]
+    if not todo:
+        return dict()
+    encoder = settings.findEncoder()
+
+    def transcode(source):
+        keydir = cachedir / settings.key(hashFile(source), encoder)
+        outpath = keydir / (source.stem + '.ogg')
+        if outpath.is_file():
+            touch(outpath)
+            return outpath
+        # same audio cached under another name
+        for other in keydir.glob('*.ogg') if keydir.is_dir() else ():
+            if not other.name.endswith('.part.ogg'):
+                copyfile(str(other), str(outpath))
+                return outpath
+        return transcodeFile(source, outpath, settings, encoder)
+
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        return dict(zip(todo, executor.map(transcode, todo)))
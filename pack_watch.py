@@ -0,0 +1,81 @@
+#! python3
+
+"""Rebuild a pack whenever its spec, or a file the spec names, changes.
+
+Files are polled with stat, and compared with a snapshot of (mtime, size,
+inode) taken after the last build, so nothing is read until something has
+changed. Once changes stop coming for a moment (so saving several files, or
+an editor's save-and-rename, makes one rebuild), the pack is rebuilt from
+the previous one: members whose files haven't changed are copied from the
+old zip as they are, and only the rest is read and compressed again.
+"""
+
+from pathlib import Path
+from time import perf_counter, sleep
+import musica_resource_packotron as mt
+
+def snapshot(paths):
+    '''{path : (mtime, size, inode)} for each path, None for ones that are missing'''
+    snap = dict()
+    for path in paths:
+        try:
+            st = path.stat()
+        except OSError:
+            snap[path] = None
+        else:
+            snap[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+    return snap
+
+def specPaths(specpath, music, pack_info, options):
+    '''The spec and every file it names'''
+    paths = {Path(specpath).resolve()}
+    for info in music.values():
+        for key in ('audioPath', 'texturePath'):
+            if info.get(key) is not None:
+                paths.add(Path(info[key]))
+    if pack_info.get('thumbnailPath') is not None:
+        paths.add(Path(pack_info['thumbnailPath']))
+    if 'textures' in options:
+        paths.add(Path(options['textures']['base']))
+    return paths
+
+def waitForChange(paths, snap, interval=0.5, debounce=0.5):
+    '''Poll paths every interval seconds until they differ from snap, then until
+    they have kept still for debounce seconds. Returns the changed paths.'''
+    current = snap
+    while current == snap:
+        sleep(interval)
+        current = snapshot(paths)
+    settled = perf_counter()
+    while perf_counter() - settled < debounce:
+        sleep(min(interval, debounce))
+        latest = snapshot(paths)
+        if latest != current:
+            current = latest
+            settled = perf_counter()
+    return [path for path in paths if current.get(path) != snap.get(path)]
+
+def watch(specpath, overrides=dict(), jobs=1, cache=None, interval=0.5, debounce=0.5):
+    '''Build the pack from specpath, then rebuild it on every change until interrupted'''
+    report = mt.BuildReport()
+    paths = {Path(specpath).resolve()}
+    while True:
+        start = perf_counter()
+        # a spec caught half saved just fails this time, and gets built once it's fixed
+        try:
+            music, pack_info, outputdir, options = mt._loadSpec(specpath)
+            paths = specPaths(specpath, music, pack_info, options)
+            snap = snapshot(paths)
+            report = mt._makePack(music, pack_info, outputdir, jobs=jobs, cache=cache, previous=report,
+                                  **mt._optionSettings(mt._mergeOptions(options, overrides)))
+        except Exception as e:
+            snap = snapshot(paths)
+            print('Build failed: %s' % e)
+        else:
+            for line in report.summary():
+                print(line)
+            print("Pack written to '%s' in %.2fs." % (report.zippath, perf_counter() - start))
+        print('Watching %s file(s) for changes (Ctrl+C to stop)...' % len(paths))
+        changed = waitForChange(paths, snap, interval, debounce)
+        print('Changed: %s' % ', '.join(path.name for path in sorted(changed)[:5])
+              + (' and %s more' % (len(changed) - 5) if len(changed) > 5 else ''))
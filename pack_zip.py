@@ -0,0 +1,324 @@
+#! python3
+
+"""A small zip writer for resource packs.
+
+Unlike zipfile.ZipFile it can take members that were already compressed
+elsewhere (another process, or an earlier build) and splice their raw
+deflate streams straight into the archive. Members written either way
+get exactly the same bytes, so packs built in parallel match packs
+built serially.
+"""
+
+from struct import pack
+from time import localtime, time
+import zlib
+
+# zipfile's compression types, without importing zipfile
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = (1 << 32) - 1
+ZIP16_LIMIT = (1 << 16) - 1
+
+def needsZip64(file_size):
+    '''Whether a member's local header gets a zip64 extra field.
+    Decided from the uncompressed size alone (like zipfile does), since a
+    streamed member's compressed size isn't known until it is written.'''
+    return file_size * 1.05 > ZIP64_LIMIT
+
+def dosDateTime(date_time):
+    '''Pack a (year, month, day, hour, min, sec) tuple into dos (time, date)'''
+    year, month, day, hour, minute, second = date_time[:6]
+    year = min(max(year, 1980), 2107)
+    return ((hour << 11) | (minute << 5) | (second // 2),
+            ((year - 1980) << 9) | (month << 5) | day)
+
+def fileAttributes(path):
+    '''The (date_time, external_attr) zipfile would give a file'''
+    from os import stat
+    st = stat(str(path))
+    return localtime(st.st_mtime)[:6], (st.st_mode & 0xFFFF) << 16
+
+def copyStream(infile, outfile):
+    '''Copy infile into outfile as it is'''
+    for chunk in iter(lambda: infile.read(CHUNK_SIZE), b''):
+        outfile.write(chunk)
+
+class MemberSink:
+    '''Takes a member's data as it is written, compressing it into outfile if
+    asked and keeping its crc and sizes.'''
+
+    def __init__(self, outfile, compress_type=ZIP_DEFLATED, level=6):
+        self.outfile = outfile
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -15) \
+            if compress_type == ZIP_DEFLATED else None
+        self.crc = 0
+        self.size = 0
+        self.compress_size = 0
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.compress_size += len(data)
+        self.outfile.write(data)
+
+    def finish(self):
+        '''Flush the compressor, returning (crc, bytes in, bytes out)'''
+        if self.compressor is not None:
+            data = self.compressor.flush()
+            self.compress_size += len(data)
+            self.outfile.write(data)
+        return self.crc, self.size, self.compress_size
+
+def deflateStream(infile, outfile, level, transform=None):
+    '''Deflate infile into outfile, returning (crc, bytes in, bytes out).
+    transform(infile, outfile), if given, changes the data on its way through.'''
+    sink = MemberSink(outfile, ZIP_DEFLATED, level)
+    (transform or copyStream)(infile, sink)
+    return sink.finish()
+
+def deflateToFile(path, outpath, level, skip=0, transform=None):
+    '''Deflate the file at path into outpath, after `skip` blank bytes; run in worker processes.
+    Returns (crc, file size, compressed size, seconds of cpu time).'''
+    from time import process_time
+    start = process_time()
+    with open(str(path), 'rb') as infile, open(str(outpath), 'wb') as outfile:
+        outfile.write(bytes(skip))
+        crc, size, compress_size = deflateStream(infile, outfile, level, transform)
+    return crc, size, compress_size, process_time() - start
+
+class ZipMember:
+    '''Everything the central directory needs to know about a member'''
+
+    __slots__ = ('arcname', 'crc', 'file_size', 'compress_size', 'compress_type',
+                 'date_time', 'external_attr', 'header_offset')
+
+    def __init__(self, arcname, compress_type, date_time, external_attr):
+        self.arcname = arcname
+        self.compress_type = compress_type
+        self.date_time = date_time
+        self.external_attr = external_attr
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.header_offset = 0
+
+    def _flags(self):
+        try:
+            self.arcname.encode('ascii')
+            return 0
+        except UnicodeEncodeError:
+            # name is utf-8
+            return 0x800
+
+    def localHeader(self, zip64):
+        '''The local file header, with the sizes known so far'''
+        name = self.arcname.encode('utf-8')
+        dostime, dosdate = dosDateTime(self.date_time)
+        if zip64:
+            extra = pack('<HHQQ', 1, 16, self.file_size, self.compress_size)
+            sizes = (ZIP64_LIMIT, ZIP64_LIMIT)
+            version = 45
+        else:
+            extra = b''
+            sizes = (self.compress_size, self.file_size)
+            version = 20
+        return pack('<4sHHHHHLLLHH', b'PK\x03\x04', version, self._flags(), self.compress_type,
+                    dostime, dosdate, self.crc, sizes[0], sizes[1], len(name), len(extra)) \
+            + name + extra
+
+    def centralHeader(self):
+        '''The central directory entry'''
+        name = self.arcname.encode('utf-8')
+        dostime, dosdate = dosDateTime(self.date_time)
+        extra_values = list()
+        file_size, compress_size, header_offset = self.file_size, self.compress_size, self.header_offset
+        if needsZip64(self.file_size) or self.file_size > ZIP64_LIMIT:
+            extra_values.append(self.file_size)
+            file_size = ZIP64_LIMIT
+        if needsZip64(self.file_size) or self.compress_size > ZIP64_LIMIT:
+            extra_values.append(self.compress_size)
+            compress_size = ZIP64_LIMIT
+        if self.header_offset > ZIP64_LIMIT:
+            extra_values.append(self.header_offset)
+            header_offset = ZIP64_LIMIT
+        if extra_values:
+            extra = pack('<HH' + 'Q' * len(extra_values), 1, 8 * len(extra_values), *extra_values)
+            version = 45
+        else:
+            extra = b''
+            version = 20
+        return pack('<4sBBHHHHHLLLHHHHHLL', b'PK\x01\x02', version, 3, version,
+                    self._flags(), self.compress_type, dostime, dosdate, self.crc,
+                    compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                    self.external_attr, header_offset) + name + extra
+
+class RawMember:
+    '''A member of an existing zip, and where its header and compressed data start in it'''
+
+    def __init__(self, info, data_offset):
+        self.arcname = info.filename
+        self.crc = info.CRC
+        self.file_size = info.file_size
+        self.compress_size = info.compress_size
+        self.compress_type = info.compress_type
+        self.date_time = info.date_time
+        self.external_attr = info.external_attr
+        self.header_offset = info.header_offset
+        self.data_offset = data_offset
+
+def readRawMembers(fileobj):
+    '''The members of the zip in a seekable binary file object, as {arcname : RawMember},
+    in order, so their data can be copied into another zip as it is'''
+    from struct import unpack
+    from zipfile import ZipFile
+    members = dict()
+    with ZipFile(fileobj) as zf:
+        for info in zf.infolist():
+            # the local header's name and extra field can differ from the central directory's
+            fileobj.seek(info.header_offset + 26)
+            name_length, extra_length = unpack('<HH', fileobj.read(4))
+            members[info.filename] = RawMember(info, info.header_offset + 30 + name_length + extra_length)
+    return members
+
+class ZipWriter:
+    '''Write a zip file member by member into a seekable binary file object.'''
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.members = list()
+        self._names = set()
+        self._offset = fileobj.tell()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def _newMember(self, arcname, compress_type, date_time, external_attr):
+        if arcname in self._names:
+            raise ValueError("Duplicate name in pack: '%s'" % arcname)
+        self._names.add(arcname)
+        member = ZipMember(arcname, compress_type, date_time, external_attr)
+        member.header_offset = self._offset
+        return member
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self._offset += len(data)
+
+    def writeRaw(self, arcname, raw, crc, file_size, compress_type,
+                 date_time=None, external_attr=0o600 << 16, compress_size=None):
+        '''Add a member whose data is already compressed.
+        raw is either bytes or a binary file object read to its end, or for
+        compress_size bytes if that is given.'''
+        member = self._newMember(arcname, compress_type,
+                                 date_time or localtime(time())[:6], external_attr)
+        member.crc = crc
+        member.file_size = file_size
+        if isinstance(raw, bytes):
+            member.compress_size = len(raw)
+            self._write(member.localHeader(needsZip64(file_size)))
+            self._write(raw)
+        elif compress_size is not None:
+            member.compress_size = compress_size
+            self._write(member.localHeader(needsZip64(file_size)))
+            left = compress_size
+            while left:
+                chunk = raw.read(min(left, CHUNK_SIZE))
+                if not chunk:
+                    raise ValueError("'%s' ended %s bytes early" % (arcname, left))
+                self._write(chunk)
+                left -= len(chunk)
+        else:
+            # sizes go in the header first, so measure the stream
+            start = raw.tell()
+            raw.seek(0, 2)
+            member.compress_size = raw.tell() - start
+            raw.seek(start)
+            self._write(member.localHeader(needsZip64(file_size)))
+            for chunk in iter(lambda: raw.read(CHUNK_SIZE), b''):
+                self._write(chunk)
+        self.members.append(member)
+        return member
+
+    def keepMember(self, raw):
+        '''List a member that is already in the file being written, a RawMember
+        from readRawMembers, in the central directory where it is. For adding
+        to a zip by writing on after its end, leaving what's there alone.'''
+        member = self._newMember(raw.arcname, raw.compress_type, raw.date_time, raw.external_attr)
+        member.header_offset = raw.header_offset
+        member.crc = raw.crc
+        member.file_size = raw.file_size
+        member.compress_size = raw.compress_size
+        self.members.append(member)
+        return member
+
+    def writeStr(self, arcname, data, compress_type=ZIP_DEFLATED, level=6,
+                 date_time=None, external_attr=0o600 << 16):
+        '''Add a member from bytes in memory'''
+        if compress_type == ZIP_DEFLATED:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            raw = compressor.compress(data) + compressor.flush()
+        else:
+            raw = data
+        return self.writeRaw(arcname, raw, zlib.crc32(data), len(data), compress_type,
+                             date_time, external_attr)
+
+    def writeFile(self, arcname, path, compress_type=ZIP_DEFLATED, level=6,
+                  date_time=None, external_attr=None, transform=None):
+        '''Stream a file into the zip, compressing it on the way if asked, and
+        passing it through transform(infile, outfile) first if one is given.
+        The header is patched with the crc and sizes afterwards.'''
+        from os import path as ospath
+        file_date_time, file_attr = fileAttributes(path)
+        member = self._newMember(arcname, compress_type, date_time or file_date_time,
+                                 file_attr if external_attr is None else external_attr)
+        member.file_size = ospath.getsize(str(path))
+        zip64 = needsZip64(member.file_size)
+        header = member.localHeader(zip64)
+        self._write(header)
+        with open(str(path), 'rb') as infile:
+            sink = MemberSink(self, compress_type, level)
+            (transform or copyStream)(infile, sink)
+            member.crc, member.file_size, member.compress_size = sink.finish()
+        if not zip64 and max(member.file_size, member.compress_size) > ZIP64_LIMIT:
+            raise ValueError("'%s' grew too large while it was being written" % path)
+        # go back and fill in the header
+        end = self._offset
+        self.fileobj.seek(member.header_offset)
+        self.fileobj.write(member.localHeader(zip64))
+        self.fileobj.seek(end)
+        self.members.append(member)
+        return member
+
+    def write(self, data):
+        '''Raw member data, for MemberSink'''
+        self._write(data)
+
+    def close(self):
+        '''Write the central directory'''
+        if self._closed:
+            return
+        self._closed = True
+        cd_offset = self._offset
+        for member in self.members:
+            self._write(member.centralHeader())
+        cd_size = self._offset - cd_offset
+        count = len(self.members)
+        if count > ZIP16_LIMIT or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            zip64_end = self._offset
+            self._write(pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                             count, count, cd_size, cd_offset))
+            self._write(pack('<4sLQL', b'PK\x06\x07', 0, zip64_end, 1))
+            count = min(count, ZIP16_LIMIT)
+            cd_size = min(cd_size, ZIP64_LIMIT)
+            cd_offset = min(cd_offset, ZIP64_LIMIT)
+        self._write(pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, count, count,
+                         cd_size, cd_offset, 0))
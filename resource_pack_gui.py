@@ -3,13 +3,79 @@
 """A basic GUI using tkinter for musica tool"""
 
 import musica_resource_packotron as mt
+import pack_events
+import pack_textures
 from pathlib import Path
+from queue import Queue, Empty
+from threading import Thread, Event
 
 from tkinter import *
 from tkinter import filedialog
 from tkinter import messagebox
 from tkinter import ttk
 
+class Track:
+    '''One entry of the track list, as it was entered'''
+
+    __slots__ = ('description', 'audio_path', 'texture_path', 'special_name', 'lore', 'is_shiny')
+
+    def __init__(self, audio_path, texture_path='', description=None):
+        self.audio_path = str(audio_path)
+        self.texture_path = str(texture_path)
+        self.description = Path(audio_path).stem if description is None else description
+        self.special_name = ''
+        self.lore = ''
+        self.is_shiny = False
+
+    def get(self, key):
+        '''A field by its name in the track info form'''
+        return getattr(self, key.replace(' ', '_'))
+
+    def set(self, key, value):
+        setattr(self, key.replace(' ', '_'), value)
+
+def scan_music_folder(folder, batch_size=500):
+    '''Walk a folder tree for .ogg files, yielding ([(audio path, texture path or None)],
+    folders scanned so far) every batch_size tracks or so. Each track is paired with
+    the .png of the same name beside it, if there is one.'''
+    from os import scandir
+    from os.path import splitext
+    folders = [str(folder)]
+    scanned = 0
+    batch = list()
+    while folders:
+        audio = list()
+        textures = dict()
+        subfolders = list()
+        try:
+            with scandir(folders.pop()) as entries:
+                for entry in entries:
+                    stem, suffix = splitext(entry.name)
+                    suffix = suffix.lower()
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(entry.path)
+                        elif suffix == '.ogg':
+                            audio.append((entry.name, entry.path))
+                        elif suffix == '.png':
+                            textures[stem.lower()] = entry.path
+                    except OSError:
+                        continue
+        except OSError:
+            # can't read it, skip it
+            continue
+        # walk the tree in name order
+        folders.extend(sorted(subfolders, reverse=True))
+        scanned += 1
+        for name, path in sorted(audio):
+            texture = textures.get(splitext(name)[0].lower())
+            batch.append((Path(path), Path(texture) if texture is not None else None))
+        # report now and then even when no tracks turn up, to show the scan is going
+        if len(batch) >= batch_size or scanned % 100 == 0:
+            yield batch, scanned
+            batch = list()
+    yield batch, scanned
+
 class MusicaApp(ttk.Frame):
     '''Main app window'''
 
@@ -21,19 +87,26 @@ class MusicaApp(ttk.Frame):
         'track description' : 'The description of the in-game Record item(s), often of the form "Artist - Title".' \
             + ' This otherwise uses the filename without the (.ogg) suffix.',
         'music listbox' : 'The list of the tracks by description, clicking one will fill the track info entries ' \
-            + 'with its own info.',
+            + 'with its own info. Shift or Ctrl click to pick several, to edit or remove them all at once.',
         'add track' : 'Choose one or more audio-files and add to the track list.',
-        'remove track' : 'Delete current/last selected track and remove from list.',
+        'import folder' : 'Add every .ogg file in a folder and its subfolders to the track list, ' \
+            + 'with the .png of the same name beside it as its texture (or the default record texture).',
+        'remove track' : 'Delete current/last selected track(s) and remove from list.',
         'audio path' : 'The .ogg file to be used for the sound of the track.',
         'texture path' : 'The .png file to be used as the Record item texture.',
         'is shiny' : 'Give the Record item of the track a shine, like an enchanted item.',
         'special name' : 'If not blank, this will change the default item name from "Music Disc" to ' \
             + 'the given special name.',
         'lore' : 'If not blank, this will add an extra line of text (lore) to the Record item.',
-        'set track info' : 'Change current/last selected track\'s info to the entered track info.',
+        'set track info' : 'Change current/last selected track(s)\' info to the entered track info. ' \
+            + 'With several tracks selected, only the entries changed are set on them all.',
         'output dir' : 'Resource Pack will be written into this directory. (default: "./")',
+        'cancel' : 'Stop making the pack, leaving nothing behind.',
         }
 
+    # how often (ms) the window checks on a running build
+    poll_interval = 100
+
     def __init__(self, master=None, **kwds):
         super().__init__(master, **kwds)
 
@@ -54,6 +127,11 @@ class MusicaApp(ttk.Frame):
         
         menu_default_texture.add_command(label='Set...', command=set_default_texture)
         menu_default_texture.add_command(label='Clear', command=clear_default_texture)
+        # give each track using the default texture its own colour of it
+        self.vary_default_texture = BooleanVar()
+        self.vary_default_texture.set(False)
+        menu_default_texture.add_checkbutton(label='Vary Per Track', variable=self.vary_default_texture,
+                                             onvalue=True, offvalue=False)
         menubar.add_cascade(menu=menu_default_texture, label='Default Record Texture')
         master.config(menu=menubar)
 
@@ -85,8 +163,33 @@ class MusicaApp(ttk.Frame):
         outputdirframe.columnconfigure(1, weight=1)
         outputdirframe.rowconfigure(0, weight=1)
 
-        # Button to do the thing
-        doitbutton = ttk.Button(self, text='Do it', command=self.make_pack)
+        # Button to do the thing, and to stop it, with progress while it runs
+        buildframe = ttk.Frame(self)
+
+        self.doitbutton = ttk.Button(buildframe, text='Do it', command=self.make_pack)
+        self.doitbutton.grid(column=0, row=0, sticky=E, padx=3)
+
+        self.cancelbutton = ttk.Button(buildframe, text='Cancel', command=self.cancel_pack)
+        self.cancelbutton.state(['disabled'])
+        self.cancelbutton.grid(column=1, row=0, sticky=W, padx=3)
+        self._bind_display_help(self.cancelbutton, 'cancel')
+
+        self.progressvar = DoubleVar()
+        self.progressvar.set(0)
+        ttk.Progressbar(buildframe, variable=self.progressvar, maximum=1.0
+                        ).grid(column=0, row=1, columnspan=2, sticky=(W,E), pady=3)
+
+        self.progresstextvar = StringVar()
+        self.progresstextvar.set('')
+        ttk.Label(buildframe, textvariable=self.progresstextvar).grid(column=0, row=2, columnspan=2)
+
+        buildframe.columnconfigure(0, weight=1)
+        buildframe.columnconfigure(1, weight=1)
+
+        # the running build, if any
+        self.build_thread = None
+        self.build_queue = Queue()
+        self.build_cancel = Event()
 
         # Status bar to display help
         self.helptextvar = StringVar()
@@ -108,7 +211,7 @@ class MusicaApp(ttk.Frame):
         
         notebook.grid(column=0, row=0, **kwds)
         outputdirframe.grid(column=0, row=1, **kwds)
-        doitbutton.grid(column=0, row=2, sticky=N, pady=kwds['pady'])
+        buildframe.grid(column=0, row=2, sticky=(N,W,E), pady=kwds['pady'])
         statusframe.grid(column=0, row=3, sticky=(S,W,E))
         
         self.columnconfigure(0, weight=1)
@@ -151,25 +254,26 @@ class MusicaApp(ttk.Frame):
         
         music = dict()
         skipped_tracks = list()
+        # folder imports bring in lots of "01 Intro.ogg"s, each needs its own name
+        names = mt.NameAllocator()
         
-        for track in self.musicdictlist:
+        for track in self.tracks:
             d = {
-                'audioPath' : Path( track['audio path'] ).resolve(),
-                'texturePath' : Path( track.get('texture path', '') ).resolve(),
-                'useSpecialName' : track.get('special name', '') != '',
-                'isShiny' : track.get('is shiny', '') != '',
-                'hasLore' : track.get('lore', '') != '',
+                'audioPath' : Path( track.audio_path ).resolve(),
+                'texturePath' : Path( track.texture_path ).resolve(),
+                'useSpecialName' : track.special_name != '',
+                'isShiny' : track.is_shiny,
+                'hasLore' : track.lore != '',
             }
-            d['description'] = d['audioPath'].stem if track.get('description', '') == '' else track['description']
+            d['description'] = d['audioPath'].stem if track.description == '' else track.description
             if d['useSpecialName']:
-                d['specialName'] = track['special name']
+                d['specialName'] = track.special_name
             if d['hasLore']:
-                d['lore'] = track['lore']
+                d['lore'] = track.lore
 
             # Throw out bad tracks here?
             if Path(d['audioPath']).is_file() and d['texturePath'].is_file():
-                clean_name = mt._processFilename(d['audioPath'].stem)
-                music[clean_name] = d
+                music[names.allocate(mt._processFilename(d['audioPath'].stem))] = d
             else:
                 # keep info on what we didnt use
                 skipped_tracks.append(track)
@@ -182,7 +286,7 @@ class MusicaApp(ttk.Frame):
         if not outputdir.is_dir():
             self._show_error('Bad Data', 'Output directory does not exist.')
         elif len(music) == 0:
-            if len(self.musicdictlist) == 0:
+            if len(self.tracks) == 0:
                 self._show_error('Bad Data', 'Track list is empty.')
             else:
                 self._show_error('Bad Data','Track list does not contain any tracks with proper Audio and Texture files.')
@@ -192,15 +296,138 @@ class MusicaApp(ttk.Frame):
             # warnings
             if len(skipped_tracks) > 0:
                 self._show_warning('%s of %s track(s) were skipped due to improper data.'
-                                   % (len(skipped_tracks), len(self.musicdictlist))
+                                   % (len(skipped_tracks), len(self.tracks))
                                    )
             if pack_info['thumbnailPath'] is None and self.packinfovars['thumbnail path'].get() != '':
                 self._show_warning('Given Thumbnail file does not exist. Defaulted to None.')
-            # make the pack
-            mt._makePack(music, pack_info, outputdir)
+            textures = None
+            if self.vary_default_texture.get() and self.default_record_texture is not None:
+                textures = pack_textures.TextureSettings(Path(self.default_record_texture).resolve())
+            # make the pack in the background, so the window keeps responding
+            self.doitbutton.state(['disabled'])
+            self.cancelbutton.state(['!disabled'])
+            self.progressvar.set(0)
+            self.progresstextvar.set('Starting...')
+            self.build_cancel.clear()
+            self.build_thread = Thread(target=self._build_pack, daemon=True,
+                                       args=(music, pack_info, outputdir, textures))
+            self.build_thread.start()
+            self.after(self.poll_interval, self._poll_build)
+
+    def cancel_pack(self):
+        """Stop the running build"""
+        self.build_cancel.set()
+        self.cancelbutton.state(['disabled'])
+        self.progresstextvar.set('Cancelling...')
+
+    def _build_pack(self, music, pack_info, outputdir, textures):
+        """Make the pack; runs in a worker thread, and only talks to the window through the queue"""
+        meter = pack_events.ProgressMeter(lambda status: self.build_queue.put(('progress', status)),
+                                             self.poll_interval / 1000)
+        try:
+            mt._makePack(music, pack_info, outputdir, textures=textures,
+                         events=pack_events.BuildEvents(meter), cancel=self.build_cancel)
+        except mt.BuildCancelled:
+            self.build_queue.put(('cancelled',))
+        except Exception as e:
+            self.build_queue.put(('error', e))
+        else:
+            self.build_queue.put(('done', outputdir))
+
+    def _poll_build(self):
+        """Show what the build has been up to since last time"""
+        events = list()
+        try:
+            while True:
+                events.append(self.build_queue.get_nowait())
+        except Empty:
+            pass
+        # only the latest progress matters
+        finished = [event for event in events if event[0] != 'progress']
+        updates = [event for event in events if event[0] == 'progress']
+        if updates and not finished:
+            status = updates[-1][1]
+            self.progressvar.set(status['done'] / status['total'] if status['total'] else 0)
+            if status['file'] is None:
+                self.progresstextvar.set('%s...' % (status['stage'] or 'Starting').capitalize())
+            else:
+                self.progresstextvar.set('%s  %s / %s  %s/s  %s' % (
+                    Path(status['file']).name, mt._formatBytes(status['done']),
+                    mt._formatBytes(status['total']), mt._formatBytes(status['rate']),
+                    'ETA %d:%02d' % divmod(int(status['eta']), 60) if status['eta'] is not None else ''))
+        if not finished:
+            self.after(self.poll_interval, self._poll_build)
+            return
+        self.build_thread = None
+        self.doitbutton.state(['!disabled'])
+        self.cancelbutton.state(['disabled'])
+        event = finished[-1]
+        if event[0] == 'done':
+            self.progressvar.set(1.0)
+            self.progresstextvar.set('Done.')
             # show message on info bar
-            self.helptextvar.set("Pack written in '%s'." % outputdir \
+            self.helptextvar.set("Pack written in '%s'." % event[1] \
                 + "\nMove to resource folder ('\\minecraft\\resourcepacks\\') and turn on in options to use.")
+        elif event[0] == 'cancelled':
+            self.progressvar.set(0)
+            self.progresstextvar.set('Cancelled.')
+        else:
+            self.progressvar.set(0)
+            self.progresstextvar.set('Failed.')
+            self._show_error('Build Failed', str(event[1]))
+
+    def _add_tracks(self, tracks):
+        """Add tracks to the end of the track list"""
+        self.tracks.extend(tracks)
+        if tracks:
+            self.musiclistbox.insert(END, *(track.description for track in tracks))
+
+    def import_folder(self):
+        """Scan a folder for tracks in the background, adding them as they turn up"""
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        default_texture = '' if self.default_record_texture is None else Path(self.default_record_texture).resolve()
+        self.importbutton.state(['disabled'])
+        self.importtextvar.set('Scanning...')
+        Thread(target=self._scan_folder, args=(folder, default_texture), daemon=True).start()
+        self.after(self.poll_interval, self._poll_import)
+
+    def _scan_folder(self, folder, default_texture):
+        """Scan for tracks; runs in a worker thread, and only talks to the window through the queue"""
+        try:
+            for batch, scanned in scan_music_folder(folder):
+                tracks = [Track(audio, default_texture if texture is None else texture)
+                          for audio, texture in batch]
+                self.import_queue.put(('tracks', tracks, scanned))
+        except Exception as e:
+            self.import_queue.put(('error', e))
+        else:
+            self.import_queue.put(('done',))
+
+    def _poll_import(self):
+        """Add the tracks found since last time"""
+        finished = None
+        try:
+            while finished is None:
+                event = self.import_queue.get_nowait()
+                if event[0] == 'tracks':
+                    self._add_tracks(event[1])
+                    self.importtextvar.set('Scanned %s folder(s), %s track(s) in the list...'
+                                           % (event[2], len(self.tracks)))
+                else:
+                    finished = event
+        except Empty:
+            pass
+        if finished is None:
+            self.after(self.poll_interval, self._poll_import)
+            return
+        self.importbutton.state(['!disabled'])
+        if finished[0] == 'done':
+            self.importtextvar.set('%s track(s) in the list.' % len(self.tracks))
+        else:
+            self.importtextvar.set('')
+            self._show_error('Import Failed', str(finished[1]))
 
     def _make_music_frame(self, master, framekwds):
         '''Make the Music frame'''
@@ -208,7 +435,8 @@ class MusicaApp(ttk.Frame):
 
         self.default_record_texture
 
-        self.trackid = None
+        # indices of the current/last selected tracks
+        self.selected_tracks = ()
 
         # The Track list
         tracklistframe = ttk.LabelFrame(musicframe, text='Track List', **framekwds)
@@ -216,10 +444,12 @@ class MusicaApp(ttk.Frame):
         # The Music listbox
         musiclistboxframe = ttk.Frame(tracklistframe, **framekwds)
 
-        self.musicdictlist = []
-        musicnamelistvar = StringVar()
-        
-        musiclistbox = Listbox(musiclistboxframe, listvariable=musicnamelistvar)
+        # the listbox rows mirror self.tracks, and are only ever changed where tracks change
+        self.tracks = []
+
+        # keep the selection while typing in the track info entries
+        musiclistbox = Listbox(musiclistboxframe, selectmode=EXTENDED, exportselection=False)
+        self.musiclistbox = musiclistbox
         musiclistbox.grid(column=0, row=0, sticky=(N,E,S,W))
         self._bind_display_help(musiclistbox, 'music listbox')
 
@@ -238,15 +468,8 @@ class MusicaApp(ttk.Frame):
         def add_track(*args):
             '''create a new track and update the list box'''
             files = filedialog.askopenfilename(multiple=True, filetypes=[('OGG', '*.ogg')])
-            for path in map(Path, files):
-                self.musicdictlist.append( {
-                    'description' : path.stem,
-                    'audio path' : path,
-                    'texture path' : '' if self.default_record_texture is None else Path(self.default_record_texture).resolve(),
-                    } )
-            musicnamelistvar.set(
-                tuple( map(lambda x : x['description'], self.musicdictlist) )
-                )
+            texture = '' if self.default_record_texture is None else Path(self.default_record_texture).resolve()
+            self._add_tracks([Track(path, texture) for path in map(Path, files)])
         
         w = ttk.Button(tracklistframe, text='Add Track(s)', command=add_track)
         w.grid(column=0, row=1, sticky=(N,W))
@@ -254,22 +477,33 @@ class MusicaApp(ttk.Frame):
 
         # The remove track button
         def remove_track(*args):
-            '''Delete selected track and update list box'''
-            trackid=musiclistbox.curselection()
-            if len(trackid)==1:
-                del self.musicdictlist[trackid[0]]
-                musicnamelistvar.set(
-                    tuple( map(lambda x : x['description'], self.musicdictlist) )
-                    )
+            '''Delete selected tracks and update list box'''
+            # from the bottom up, so the indices still left stay good
+            for trackid in sorted(self.selected_tracks, reverse=True):
+                if trackid < len(self.tracks):
+                    del self.tracks[trackid]
+                    musiclistbox.delete(trackid)
+            self.selected_tracks = ()
         
-        w = ttk.Button(tracklistframe, text='Remove Track', command=remove_track)
+        w = ttk.Button(tracklistframe, text='Remove Track(s)', command=remove_track)
         w.grid(column=1, row=1, sticky=(N, W))
         self._bind_display_help(w, 'remove track')
 
+        # The import folder button
+        self.importbutton = ttk.Button(tracklistframe, text='Import Folder...', command=self.import_folder)
+        self.importbutton.grid(column=0, row=2, sticky=(N,W))
+        self._bind_display_help(self.importbutton, 'import folder')
+
+        self.importtextvar = StringVar()
+        self.importtextvar.set('')
+        ttk.Label(tracklistframe, textvariable=self.importtextvar).grid(column=1, row=2, sticky=(N,W))
+        self.import_queue = Queue()
+
         tracklistframe.columnconfigure(0, weight=1)
         tracklistframe.columnconfigure(1, weight=1)
         tracklistframe.rowconfigure(0, weight=1)
         tracklistframe.rowconfigure(1, weight=1)
+        tracklistframe.rowconfigure(2, weight=1)
 
         # Track info
         trackinfovars = {
@@ -278,8 +512,14 @@ class MusicaApp(ttk.Frame):
             'texture path' : StringVar(),
             'special name' : StringVar(),
             'lore' : StringVar(),
-            'is shiny' : StringVar(),
+            'is shiny' : BooleanVar(),
             }
+        # the entries changed since the selection was last shown, which are all Set Info sets
+        edited_info = set()
+        self.filling_track_info = False
+        for key, infovar in trackinfovars.items():
+            infovar.trace_add('write', lambda *args, key=key:
+                              None if self.filling_track_info else edited_info.add(key))
 
         trackinfoframe = ttk.LabelFrame(musicframe, text='Track Info', **framekwds)
         
@@ -327,9 +567,9 @@ class MusicaApp(ttk.Frame):
 
         trackoptionsframe = ttk.LabelFrame(trackinfoframe, text='Additional Options', **framekwds)
 
-        w = ttk.Checkbutton(trackoptionsframe, text='Is Shiny', variable=trackinfovars['is shiny'])
-        w.grid(column=0, row=0, columnspan=2)
-        self._bind_display_help(w, 'is shiny')
+        shinybutton = ttk.Checkbutton(trackoptionsframe, text='Is Shiny', variable=trackinfovars['is shiny'])
+        shinybutton.grid(column=0, row=0, columnspan=2)
+        self._bind_display_help(shinybutton, 'is shiny')
 
         w = ttk.Label(trackoptionsframe, text='Special Name:')
         w.grid(column=0, row=1, sticky=E, pady=3)
@@ -356,12 +596,17 @@ class MusicaApp(ttk.Frame):
         trackoptionsframe.rowconfigure(2, weight=1)
         
         def set_info(*args):
-            if self.trackid is not None and self.trackid < len(self.musicdictlist):
-                for key, infovar in trackinfovars.items():
-                    self.musicdictlist[self.trackid][key] = infovar.get()
-                musicnamelistvar.set(
-                    tuple( map(lambda x : x['description'], self.musicdictlist) )
-                    )
+            '''Set the edited info on the selected tracks, redrawing only their rows'''
+            trackids = [trackid for trackid in self.selected_tracks if trackid < len(self.tracks)]
+            for trackid in trackids:
+                for key in edited_info:
+                    self.tracks[trackid].set(key, trackinfovars[key].get())
+            if 'description' in edited_info:
+                for trackid in trackids:
+                    musiclistbox.delete(trackid)
+                    musiclistbox.insert(trackid, self.tracks[trackid].description)
+                    musiclistbox.selection_set(trackid)
+            edited_info.clear()
 
         w = ttk.Button(trackinfoframe, text='Set Info', command=set_info)
         w.grid(column=0, row=4, columnspan=2, pady=3)
@@ -374,12 +619,21 @@ class MusicaApp(ttk.Frame):
 
         # Change info to display a track's current info
         def select_music(*args):
-            '''Change display according to selected track'''
-            trackid=musiclistbox.curselection()
-            if len(trackid) == 1:
-                self.trackid = trackid[0]
-                for key,infovar in trackinfovars.items():
-                    infovar.set( self.musicdictlist[trackid[0]].get(key, '') )
+            '''Change display according to selected tracks; entries they don't agree on are left blank'''
+            trackids = musiclistbox.curselection()
+            if len(trackids) == 0:
+                return
+            self.selected_tracks = trackids
+            self.filling_track_info = True
+            for key, infovar in trackinfovars.items():
+                values = set(self.tracks[trackid].get(key) for trackid in trackids)
+                blank = False if key == 'is shiny' else ''
+                infovar.set(values.pop() if len(values) == 1 else blank)
+                if key == 'is shiny':
+                    # tick box half set when only some of them are shiny
+                    shinybutton.state(['alternate' if values else '!alternate'])
+            self.filling_track_info = False
+            edited_info.clear()
         
         musiclistbox.bind('<<ListboxSelect>>', select_music)
 
@@ -463,7 +717,8 @@ class MusicaApp(ttk.Frame):
         return packinfoframe
         
 
-if __name__ == '__main__':
+def make_window():
+    """Set up the main window, ready for mainloop()"""
     from sys import platform
     
     root = Tk()
@@ -493,5 +748,7 @@ if __name__ == '__main__':
     main_frame.grid(column=0, row=0, sticky=(N, W, E, S))
     root.columnconfigure(0, weight=1)
     root.rowconfigure(0, weight=1)
+    return root
 
-    root.mainloop()
+if __name__ == '__main__':
+    make_window().mainloop()